@@ -4,11 +4,42 @@ import yaml
 import subprocess
 import datetime
 import argparse
+import atexit
+import contextlib
+import functools
 import requests
 import time
-import glob
+import gzip
+import re
+import queue
+import select
 import shutil
+import shlex
+import signal
+import tempfile
+import heapq
+import itertools
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from concurrent.futures import wait as wait_futures
 from pathlib import Path
+from urllib3.util.retry import Retry
+
+try:
+    import fcntl
+except ImportError: # Not available on Windows
+    fcntl = None
+
+try:
+    import mariadb # Optional: MariaDB Connector/Python, used for small queries instead of the CLI
+except ImportError:
+    mariadb = None
+
+try:
+    from yaml import CSafeLoader as YamlLoader # libyaml, much faster when available
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
 
 # ANSI Color Codes
 GREEN = "\033[92m"
@@ -17,26 +48,179 @@ CYAN = "\033[96m"
 YELLOW = "\033[93m"
 RESET = "\033[0m"
 
-def load_config():
-    if not os.path.exists("config.yml"):
-        print(f"{RED}Config file 'config.yml' not found.{RESET}")
+# External tools are resolved once at startup so every spawn gets an absolute path
+# and a missing tool is reported clearly instead of surfacing as a Popen error.
+# pigz, when present, replaces gzip and produces the same .gz format using all cores.
+TOOLS = {name: shutil.which(name) for name in ("mariadb-dump", "mariadb", "docker", "gzip", "pigz", "zstd")}
+TOOL_HINTS = {
+    "mariadb-dump": "Please install mariadb-client or configure to use docker exec.",
+    "mariadb": "Please install mariadb-client or configure to use docker exec.",
+    "docker": "Please install Docker or remove 'container' from the server config.",
+    "zstd": "Please install zstd or use the gzip compressor.",
+}
+
+# File extension written by each supported compressor
+BACKUP_EXTENSIONS = {"gzip": ".sql.gz", "zstd": ".sql.zst"}
+DEFAULT_COMPRESS_LEVELS = {"gzip": 6, "zstd": 3}
+
+# db_name-DD-MM-YYYY-N.sql.gz (or .sql.zst); db_name may itself contain dashes
+_BACKUP_RE = re.compile(
+    r"^(?P<db>.+)-(?P<day>\d{2})-(?P<month>\d{2})-(?P<year>\d{4})-(?P<n>\d+)"
+    r"(?P<ext>" + "|".join(re.escape(ext) for ext in BACKUP_EXTENSIONS.values()) + r")$"
+)
+
+# Larger INSERT batches per packet mean fewer round trips while dumping.
+# Kept below the 16MB server max_allowed_packet default so dumps restore as-is.
+DEFAULT_NET_BUFFER_LENGTH = 8 * 1024 * 1024
+MAX_ALLOWED_PACKET = 1024 * 1024 * 1024
+
+# Consistent InnoDB snapshot without locking tables, streamed row by row
+DEFAULT_DUMP_OPTIONS = ["--single-transaction", "--skip-lock-tables", "--quick", "--extended-insert", "--hex-blob"]
+
+# Kernel pipe size between dump and compressor (Linux default is 64KB)
+PIPE_BUFFER_SIZE = 1024 * 1024
+# Compressed data held for an upload_command that is slower than the local write
+UPLOAD_BUFFER_SIZE = 64 * 1024 * 1024
+F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031) # Only exposed by Python 3.10+
+
+# Notifications are posted from a single background worker so backups never
+# wait on Discord; the shared session keeps the HTTPS connection alive.
+_NOTIFY_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="discord")
+_SESSION = requests.Session()
+# Rate limits (429, honoring Retry-After) and gateway errors are retried with backoff.
+# Read errors are not: Discord may already have posted the message.
+DISCORD_RETRY = Retry(
+    total=3, read=0, backoff_factor=0.5,
+    status_forcelist=(429, 502, 503, 504), allowed_methods=frozenset({"POST"}),
+)
+_SESSION.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=DISCORD_RETRY))
+DISCORD_TIMEOUT = (3, 5) # Connect/read seconds; a stalled webhook only delays other notifications
+DISCORD_MAX_LENGTH = 2000 # Characters per webhook message
+
+# Our own descriptors are non-inheritable anyway (PEP 446); keeping close_fds off lets
+# CPython start the dump pipeline with posix_spawn() instead of fork()+exec()
+SPAWN_OPTIONS = {"close_fds": False}
+
+# Environment snapshot for docker exec, extended with MYSQL_PWD per call (see _client_env)
+_BASE_ENV = dict(os.environ)
+
+# Local clients read passwords from private option files instead (see _defaults_file_option);
+# one file per distinct password, removed at exit and on SIGTERM (see _terminate)
+_CREDENTIALS_DIR = None
+_CREDENTIALS_PREFIX = "mariadb-backup-"
+_CREDENTIALS_FILES = {}
+_CREDENTIALS_LOCK = threading.Lock()
+
+# host -> (expires, databases) from SHOW DATABASES, see get_databases
+_DATABASES_CACHE = {}
+DATABASES_CACHE_TTL = 900
+
+# host dir -> (dir mtime_ns, [(name, size, mtime)]) of its backup files, see _host_index
+_HOST_INDEX = {}
+# host dir -> number of invalidations, so a listing taken before one is never cached after it
+_HOST_INDEX_GENERATION = defaultdict(int)
+_HOST_INDEX_LOCK = threading.Lock()
+# Listings taken this close to the directory's last change aren't cached: another
+# change within the same timestamp tick would leave the mtime unchanged
+HOST_INDEX_RACY_NS = 1_000_000_000
+
+# Connector pools per server, reused across daemon runs (see _server_pool)
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+POOL_SIZE = 4
+
+# Longest single sleep of the daemon between checks of its schedule
+DAEMON_MAX_SLEEP = 300
+# Self-pipe written on SIGHUP; wakes the daemon to reload config.yml without a restart
+# (see _request_reload). None where SIGHUP doesn't exist.
+_RELOAD_PIPE = None
+
+# Per-database locks for parallel backups; per-host limits are kept by _BackupPool
+_DB_LOCKS = defaultdict(threading.Lock)
+
+@functools.lru_cache(maxsize=4)
+def _load_config_cached(path, mtime_ns):
+    # mtime_ns is only part of the cache key, so an edited file is parsed again
+    with open(path, "r") as f:
+        return yaml.load(f, Loader=YamlLoader)
+
+def load_config(path="config.yml"):
+    if not os.path.exists(path):
+        print(f"{RED}Config file '{path}' not found.{RESET}")
         sys.exit(1)
     try:
-        with open("config.yml", "r") as f:
-            return yaml.safe_load(f)
+        return _load_config_cached(path, os.stat(path).st_mtime_ns)
     except Exception as e:
-        print(f"{RED}Error loading config.yml: {e}{RESET}")
+        print(f"{RED}Error loading {path}: {e}{RESET}")
         sys.exit(1)
 
+def _post_discord(webhook_url, message):
+    try:
+        _SESSION.post(webhook_url, json={"content": message}, timeout=DISCORD_TIMEOUT)
+    except requests.ConnectTimeout: # Subclass of Timeout, so checked first
+        print(f"{RED}Error sending discord notification: could not connect within {DISCORD_TIMEOUT[0]}s{RESET}")
+    except requests.Timeout:
+        print(f"{RED}Error sending discord notification: no response within {DISCORD_TIMEOUT[1]}s{RESET}")
+    except Exception as e:
+        print(f"{RED}Error sending discord notification: {e}{RESET}")
+
 def send_discord_notification(config, message):
     webhook_url = config.get("discord", {}).get("webhook_url")
     if not webhook_url or webhook_url == "YOUR_DISCORD_WEBHOOK_URL":
         return
     
-    try:
-        requests.post(webhook_url, json={"content": message})
-    except Exception as e:
-        print(f"{RED}Error sending discord notification: {e}{RESET}")
+    # Returns the Future so callers that need delivery can wait on it
+    return _NOTIFY_POOL.submit(_post_discord, webhook_url, message)
+
+class NotificationBuffer:
+    # Collects the notifications of a batch of backups (see run_all_now) and posts them
+    # together, as few webhook messages as Discord's length limit allows
+    def __init__(self):
+        self._messages = []
+        self._lock = threading.Lock()
+
+    def add(self, message):
+        with self._lock:
+            self._messages.append(message)
+
+    def flush(self, config):
+        with self._lock:
+            messages, self._messages = self._messages, []
+
+        chunks = []
+        current = ""
+        for message in messages:
+            # A single over-long message (e.g. a big error) is split hard
+            for i in range(0, len(message), DISCORD_MAX_LENGTH):
+                part = message[i:i + DISCORD_MAX_LENGTH]
+                if current and len(current) + 1 + len(part) > DISCORD_MAX_LENGTH:
+                    chunks.append(current)
+                    current = part
+                else:
+                    current = f"{current}\n{part}" if current else part
+        if current:
+            chunks.append(current)
+        return [send_discord_notification(config, chunk) for chunk in chunks]
+
+def _notify(config, message, notifications=None):
+    # Into the caller's NotificationBuffer when batching, otherwise sent right away
+    if notifications is not None:
+        notifications.add(message)
+    else:
+        send_discord_notification(config, message)
+
+def _storage_path(config):
+    storage = config.get("_storage")
+    if storage is None:
+        storage = Path(config.get("storage", {}).get("path", "./backups"))
+    return storage
+
+def _host_dir(config, host):
+    # Backup directory of a host; precomputed for configured servers by _normalize_config
+    host_dir = config.get("_host_dirs", {}).get(host)
+    if host_dir is None:
+        host_dir = _storage_path(config) / host
+    return host_dir
 
 def get_retention_policy(config, db_name):
     retention = config.get("retention", {})
@@ -45,9 +229,68 @@ def get_retention_policy(config, db_name):
         return overrides[db_name]
     return retention.get("default", {"keep_last": 10, "max_gb": 5.0})
 
+def _backup_sort_key(match):
+    # (YYYY, MM, DD, N) from a _BACKUP_RE match
+    return (int(match["year"]), int(match["month"]), int(match["day"]), int(match["n"]))
+
+def _remove_backups(db_backup_dir, paths):
+    # Rename expired backups into a private trash directory, then delete it in one go.
+    # The directory is unique per call so parallel retention runs never share it.
+    trash_dir = tempfile.mkdtemp(prefix=".trash-", dir=db_backup_dir)
+    try:
+        for path in paths:
+            os.rename(path, os.path.join(trash_dir, os.path.basename(path)))
+    finally:
+        shutil.rmtree(trash_dir, ignore_errors=True)
+
+def _host_index(db_backup_dir):
+    # Backup files of a host directory as (name, size, mtime). The directory is only
+    # rescanned when its mtime changed, i.e. files were added, removed or renamed;
+    # call _invalidate_host_index after rewriting a file in place.
+    key = os.fspath(db_backup_dir)
+    mtime_ns = os.stat(key).st_mtime_ns
+    with _HOST_INDEX_LOCK:
+        cached = _HOST_INDEX.get(key)
+        generation = _HOST_INDEX_GENERATION[key]
+    if cached and cached[0] == mtime_ns:
+        return cached[1]
+
+    extensions = tuple(BACKUP_EXTENSIONS.values())
+    files = []
+    with os.scandir(key) as it:
+        for entry in it:
+            if entry.name.endswith(extensions) and entry.is_file():
+                st = entry.stat() # DirEntry caches it, one stat per file
+                files.append((entry.name, st.st_size, st.st_mtime))
+
+    if time.time_ns() - mtime_ns > HOST_INDEX_RACY_NS:
+        with _HOST_INDEX_LOCK:
+            if _HOST_INDEX_GENERATION[key] == generation:
+                _HOST_INDEX[key] = (mtime_ns, files)
+    return files
+
+def _invalidate_host_index(db_backup_dir):
+    key = os.fspath(db_backup_dir)
+    with _HOST_INDEX_LOCK:
+        _HOST_INDEX.pop(key, None)
+        _HOST_INDEX_GENERATION[key] += 1
+
+def _scan_backups(db_backup_dir, db_name):
+    # Returns db_name's backups as unordered (sort key, size, path) tuples, where the
+    # key orders by the date and counter in their name rather than mtime, plus the
+    # total size of all backup files in the directory. Matching the full name avoids
+    # picking up databases that share a prefix.
+    backups = []
+    total_size = 0
+    for name, size, _ in _host_index(db_backup_dir):
+        total_size += size
+        match = _BACKUP_RE.match(name)
+        if match and match["db"] == db_name:
+            backups.append((_backup_sort_key(match), size, os.path.join(db_backup_dir, name)))
+    return backups, total_size
+
 def apply_retention(config, host, db_name):
-    storage_path = Path(config.get("storage", {}).get("path", "./backups"))
-    db_backup_dir = storage_path / host
+    db_backup_dir = _host_dir(config, host)
     if not db_backup_dir.exists():
         return
 
@@ -55,163 +298,577 @@ def apply_retention(config, host, db_name):
     keep_last = policy.get("keep_last", 10)
     max_bytes = policy.get("max_gb", 5.0) * 1024 * 1024 * 1024
 
-    # Count based retention
-    # Use a more specific glob to avoid matching databases that share a prefix
-    # Pattern: db_name-DD-MM-YYYY-N.sql.gz
-    backups = sorted(
-        [f for f in db_backup_dir.glob(f"{db_name}-[0-9][0-9]-[0-9][0-9]-[0-9][0-9][0-9][0-9]-*.sql.gz")],
-        key=os.path.getmtime,
-        reverse=True
-    )
-
-    to_delete = backups[keep_last:]
-    for f in to_delete:
-        f.unlink()
-        print(f"{YELLOW}Deleted old backup (count limit): {f}{RESET}")
-    
-    # Refresh backups list for size-based check
-    backups = sorted(
-        [f for f in db_backup_dir.glob(f"{db_name}-[0-9][0-9]-[0-9][0-9]-[0-9][0-9][0-9][0-9]-*.sql.gz")],
-        key=os.path.getmtime,
-        reverse=True
-    )
+    # The (sort key, size, path) tuples are reused for both retention checks
+    backups, host_total_size = _scan_backups(db_backup_dir, db_name)
+
+    # Count based retention: only the newest keep_last need ordering, and in steady
+    # state just the one or two backups past the limit are left to sort
+    kept = heapq.nlargest(keep_last, backups)
+    if len(kept) < len(backups):
+        kept_paths = {path for _, _, path in kept}
+        to_delete = sorted((b for b in backups if b[2] not in kept_paths), reverse=True)
+    else:
+        to_delete = []
+    backups = kept
+    expired_paths = []
+    for _, size, path in to_delete:
+        expired_paths.append(path)
+        host_total_size -= size
+        print(f"{YELLOW}Deleted old backup (count limit): {path}{RESET}")
     
-    # Size based retention
-    total_size = sum(f.stat().st_size for f in backups)
+    # Size based retention: keep the newest backups that fit within max_bytes,
+    # everything from the first one that doesn't fit onwards is expired
+    kept_size = 0
+    expired = []
+    for i, (_, size, _) in enumerate(backups):
+        if kept_size + size > max_bytes:
+            expired = backups[i:]
+            break
+        kept_size += size
+    total_size = kept_size + sum(size for _, size, _ in expired)
     
-    # Calculate total size of all backups in this host directory to warn about stale files
-    all_files = list(db_backup_dir.glob("*.sql.gz"))
-    host_total_size = sum(f.stat().st_size for f in all_files)
+    # Compare against all backups in this host directory to warn about stale files
     stale_size = host_total_size - total_size
     if stale_size > 10 * 1024 * 1024: # More than 10MB of potentially stale files
         print(f"{YELLOW}Note: {stale_size / (1024*1024):.2f} MB of other backup files found in {db_backup_dir} (not managed by {db_name} policy){RESET}")
 
-    if backups and total_size > max_bytes:
+    if expired:
         print(f"{CYAN}Size limit exceeded for {db_name} ({total_size / (1024**3):.2f}GB > {max_bytes / (1024**3):.2f}GB). Pruning...{RESET}")
-    while total_size > max_bytes and backups:
-        oldest = backups.pop()
-        total_size -= oldest.stat().st_size
-        oldest.unlink()
+    for _, _, oldest in reversed(expired):
+        expired_paths.append(oldest)
         print(f"{YELLOW}Deleted old backup (size limit): {oldest}{RESET}")
 
+    if expired_paths:
+        _remove_backups(db_backup_dir, expired_paths)
+
+def get_tool(name):
+    path = TOOLS.get(name)
+    if not path:
+        raise Exception(f"{name} not found. {TOOL_HINTS.get(name, f'Please install {name}.')}")
+    return path
+
+def find_missing_tools(config):
+    # Problems with the tools the configured backups will need, so 'now' and the daemon
+    # can refuse to start instead of failing every backup one by one
+    needed = set()
+    for server in config.get("servers", []):
+        if server.get("container"):
+            needed.add("docker")
+            continue
+        needed.add("mariadb-dump")
+        # "all" without the connector is expanded with the mariadb client
+        if mariadb is None and any(db_name == "all" for db_name, _ in _server_jobs(server)):
+            needed.add("mariadb")
+
+    compress_cmd = config.get("storage", {}).get("compress_command")
+    if not compress_cmd:
+        if get_compressor(config) == "zstd":
+            needed.add("zstd")
+        elif not TOOLS["pigz"]:
+            needed.add("gzip")
+
+    problems = [f"{name} not found. {TOOL_HINTS.get(name, f'Please install {name}.')}" for name in sorted(needed) if not TOOLS.get(name)]
+
+    if compress_cmd:
+        try:
+            get_compress_command(config)
+        except Exception as e:
+            problems.append(str(e))
+
+    upload_cmd = config.get("storage", {}).get("upload_command")
+    if upload_cmd:
+        program = shlex.split(upload_cmd)[0] if isinstance(upload_cmd, str) else str(upload_cmd[0])
+        if not shutil.which(program):
+            problems.append(f"{program} not found. Please install it or fix storage.upload_command.")
+        try:
+            get_upload_command(config, "host", "database", "filename")
+        except (KeyError, IndexError, ValueError) as e:
+            problems.append(f"Invalid placeholder in storage.upload_command: {e}. Write literal braces as {{{{ and }}}}.")
+    return problems
+
+def get_compressor(config):
+    compressor = config.get("storage", {}).get("compressor", "gzip")
+    if compressor not in BACKUP_EXTENSIONS:
+        print(f"{RED}Unsupported compressor '{compressor}', falling back to gzip. Use one of: {', '.join(BACKUP_EXTENSIONS)}{RESET}")
+        return "gzip"
+    return compressor
+
+def get_backup_extension(config):
+    return BACKUP_EXTENSIONS[get_compressor(config)]
+
+def get_compress_command(config):
+    storage = config.get("storage", {})
+    compressor = get_compressor(config)
+    command = storage.get("compress_command")
+    if command:
+        # Custom command, e.g. "gzip --rsyncable", reads stdin and writes stdout
+        if isinstance(command, str):
+            command = shlex.split(command)
+        command = [str(part) for part in command]
+        # Checked before the dump starts, which would otherwise be left writing to nobody
+        if not shutil.which(command[0]):
+            raise Exception(f"{command[0]} not found. Please install it or fix storage.compress_command.")
+        return command
+
+    level = storage.get("compress_level", DEFAULT_COMPRESS_LEVELS[compressor])
+    # Threads per compressor; lower it when several backups run in parallel
+    threads = storage.get("compress_threads")
+    # Resync the stream periodically so rsync/dedup storage only ships changed regions
+    extra = ["--rsyncable"] if storage.get("rsyncable", False) else []
+    if compressor == "zstd":
+        # -q: zstd draws a progress line when stderr is a terminal, garbling parallel output
+        return [get_tool("zstd"), "-q", f"-T{threads or 0}", f"-{level}"] + extra
+    if TOOLS["pigz"]:
+        return [TOOLS["pigz"], "-p", str(threads or os.cpu_count() or 1), f"-{level}"] + extra
+    return [get_tool("gzip"), f"-{level}"] + extra
+
+def get_decompress_command(backup_file_path):
+    # None means the .gz file is decompressed in-process by restore_backup
+    if str(backup_file_path).endswith(BACKUP_EXTENSIONS["zstd"]):
+        return [get_tool("zstd"), "-q", "-dc", str(backup_file_path)]
+    if TOOLS["pigz"]:
+        return [TOOLS["pigz"], "-dc", str(backup_file_path)]
+    return None
+
+def get_upload_command(config, host, db_name, filename):
+    # Optional command that receives each compressed backup on stdin as it is written,
+    # e.g. "aws s3 cp - s3://bucket/{host}/{filename}"; None when not configured
+    command = config.get("storage", {}).get("upload_command")
+    if not command:
+        return None
+    if isinstance(command, str):
+        command = shlex.split(command)
+    return [str(part).format(host=host, database=db_name, filename=filename) for part in command]
+
+class _Tee(threading.Thread):
+    # Copies the compressor output to the local file and, through a bounded buffer fed
+    # by a second thread, to the upload command's stdin. The upload never slows down the
+    # local backup: one that falls UPLOAD_BUFFER_SIZE behind is killed and its failure
+    # kept in .upload_error; otherwise its exit status is checked later.
+    # A failing local write (disk full, I/O error) stops both ends and is kept in .error
+    # for run_backup to raise. .written is set once the local file is complete.
+    def __init__(self, src, dst, upload):
+        super().__init__(daemon=True)
+        self.src, self.dst, self.upload = src, dst, upload
+        self.error = None
+        self.upload_error = None
+        self.written = threading.Event()
+
+    def run(self):
+        src = self.src
+        buffer = queue.Queue(maxsize=max(1, UPLOAD_BUFFER_SIZE // PIPE_BUFFER_SIZE))
+        feeder = threading.Thread(target=self._feed, args=(buffer,), daemon=True)
+        feeder.start()
+        try:
+            with src: # Closing it early makes the compressor exit with SIGPIPE
+                for chunk in iter(lambda: src.read(PIPE_BUFFER_SIZE), b""):
+                    try:
+                        self.dst.write(chunk)
+                    except OSError as e:
+                        self.error = e
+                        break
+                    if buffer is None:
+                        continue
+                    try:
+                        buffer.put_nowait(chunk)
+                    except queue.Full:
+                        self.upload_error = f"fell more than {UPLOAD_BUFFER_SIZE // (1024 * 1024)}MB behind the backup"
+                        self.upload.kill()
+                        buffer = None # Left to the feeder, which stops once the upload is gone
+        finally:
+            self.written.set()
+            if buffer is not None:
+                buffer.put(None) # Only waits while the upload is still reading
+
+    def _feed(self, buffer):
+        pipe = self.upload.stdin
+        for chunk in iter(buffer.get, None):
+            if pipe is None:
+                continue # Upload gone, drain so the copier never blocks
+            try:
+                pipe.write(chunk)
+            except (BrokenPipeError, ValueError):
+                pipe = None
+            if self.upload_error:
+                break # Given up on, the rest of the buffer is abandoned
+        if pipe:
+            try:
+                pipe.close()
+            except BrokenPipeError:
+                pass
+
+def _start_compressor(gzip_cmd, stdin, f, upload_cmd, upload_stderr):
+    # Returns (compressor, uploader, tee thread); the last two are None without upload_command
+    if not upload_cmd:
+        return subprocess.Popen(gzip_cmd, stdin=stdin, stdout=f, **SPAWN_OPTIONS), None, None
+
+    p2 = subprocess.Popen(gzip_cmd, stdin=stdin, stdout=subprocess.PIPE, **SPAWN_OPTIONS)
+    try:
+        p3 = subprocess.Popen(upload_cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=upload_stderr, **SPAWN_OPTIONS)
+    except BaseException:
+        # Nobody would ever read the compressor's output
+        _kill_all(p2)
+        p2.stdout.close()
+        raise
+    _enlarge_pipe(p2.stdout)
+    copier = _Tee(p2.stdout, f, p3)
+    copier.start()
+    return p2, p3, copier
+
+def _kill_all(*procs):
+    # Kills and reaps the given processes; None entries (not started) are skipped
+    for p in procs:
+        if p:
+            p.kill()
+            p.wait()
+
+def _enlarge_pipe(pipe):
+    # Fewer, larger reads/writes across the pipe; best effort and Linux only
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return
+    try:
+        fcntl.fcntl(pipe.fileno(), F_SETPIPE_SZ, PIPE_BUFFER_SIZE)
+    except OSError:
+        pass
+
+def get_dump_options(config, dump_options=None):
+    # Per-server dump_options win over storage.dump_options, which win over the defaults
+    storage = config.get("storage", {})
+    if dump_options is None:
+        dump_options = storage.get("dump_options", DEFAULT_DUMP_OPTIONS)
+    if isinstance(dump_options, str):
+        dump_options = shlex.split(dump_options)
+
+    net_buffer_length = storage.get("net_buffer_length", DEFAULT_NET_BUFFER_LENGTH)
+    # Stored procedures/functions and events aren't dumped by default (triggers are)
+    routines = ["--routines", "--events"] if storage.get("dump_routines", False) else []
+    return [
+        f"--net-buffer-length={net_buffer_length}",
+        f"--max-allowed-packet={MAX_ALLOWED_PACKET}",
+    ] + list(dump_options) + routines
+
+def _server_pool(server):
+    # Containers are only reachable through docker exec, so they always use the CLI
+    if mariadb is None or server.get("container"):
+        return None
+    key = (server["host"], int(server.get("port", 3306)), server["user"], str(server["password"]))
+    with _POOLS_LOCK:
+        if key not in _POOLS:
+            _POOLS[key] = mariadb.ConnectionPool(
+                pool_name=f"backup-{len(_POOLS)}",
+                pool_size=POOL_SIZE,
+                host=key[0], port=key[1], user=key[2], password=key[3],
+            )
+        return _POOLS[key]
+
+def _pooled_query(pool, statements):
+    # Runs the statements on one pooled connection, returns the first column of the last result
+    conn = pool.get_connection()
+    try:
+        cursor = conn.cursor()
+        for sql, params in statements:
+            cursor.execute(sql, params)
+        rows = cursor.fetchall() if cursor.description else []
+        cursor.close()
+        return [row[0] for row in rows]
+    finally:
+        conn.close() # Returns the connection to the pool
+
+def _is_loopback(host):
+    return host in ("localhost", "::1") or str(host).startswith("127.")
+
+def _credentials_base():
+    # systemd's RuntimeDirectory= and the login session's runtime dir are removed by the
+    # system even when we are killed; the temp dir is the fallback
+    return os.environ.get("RUNTIME_DIRECTORY") or os.environ.get("XDG_RUNTIME_DIR") or None
+
+def _remove_stale_credentials(base):
+    # Directories left behind by earlier runs that died without cleaning up (SIGKILL, crash),
+    # recognised by the pid in their name no longer running
+    base = base or tempfile.gettempdir()
+    try:
+        entries = os.scandir(base)
+    except OSError:
+        return
+    with entries:
+        for entry in entries:
+            if not entry.name.startswith(_CREDENTIALS_PREFIX):
+                continue
+            try:
+                pid = int(entry.name[len(_CREDENTIALS_PREFIX):].split("-", 1)[0])
+                if not entry.is_dir(follow_symlinks=False) or entry.stat(follow_symlinks=False).st_uid != os.getuid():
+                    continue
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                shutil.rmtree(entry.path, ignore_errors=True)
+            except (ValueError, OSError):
+                continue
+
+def _remove_credentials():
+    if _CREDENTIALS_DIR:
+        shutil.rmtree(_CREDENTIALS_DIR, ignore_errors=True)
+
+def _defaults_file_option(password):
+    # --defaults-extra-file for local clients, so the password is in neither argv nor the
+    # environment. Must come right after the program name.
+    global _CREDENTIALS_DIR
+    with _CREDENTIALS_LOCK:
+        path = _CREDENTIALS_FILES.get(password)
+        if path is None:
+            if _CREDENTIALS_DIR is None:
+                base = _credentials_base()
+                _remove_stale_credentials(base)
+                _CREDENTIALS_DIR = tempfile.mkdtemp(prefix=f"{_CREDENTIALS_PREFIX}{os.getpid()}-", dir=base) # mode 0700
+                atexit.register(_remove_credentials)
+            fd, path = tempfile.mkstemp(suffix=".cnf", dir=_CREDENTIALS_DIR) # mode 0600
+            # Only backslashes are escapes inside option files; the outer quotes are stripped
+            escaped = str(password).replace("\\", "\\\\").replace("\n", "\\n")
+            with os.fdopen(fd, "w") as f:
+                f.write(f'[client]\npassword="{escaped}"\n')
+            _CREDENTIALS_FILES[password] = path
+    return f"--defaults-extra-file={path}"
+
+def _terminate(signum, frame):
+    # atexit doesn't run when a signal kills the process, e.g. systemctl stop. The option
+    # files are removed right away; exiting waits for running backups, whose clients
+    # have long read them.
+    _remove_credentials()
+    sys.exit(128 + signum)
+
+def _client_env(password, container=None):
+    # docker exec -e MYSQL_PWD copies the value from its own environment into the
+    # container, keeping it off the command line; local clients inherit ours unchanged
+    # str(): YAML reads an all-digit password as an int, which Popen rejects in env
+    return {**_BASE_ENV, "MYSQL_PWD": str(password)} if container else None
+
+def list_user_schemas(pool):
+    # Non-system schemas in one query over a pooled connection
+    return _pooled_query(pool, [(
+        "SELECT schema_name FROM information_schema.schemata"
+        " WHERE schema_name NOT IN ('information_schema', 'performance_schema', 'mysql', 'sys')",
+        (),
+    )])
+
 def get_databases(server):
+    # "all" lookups are cached per host for databases_cache_ttl seconds; failed
+    # lookups are not cached and a failed backup drops the entry (see run_backup)
+    host = server["host"]
+    ttl = server.get("databases_cache_ttl", DATABASES_CACHE_TTL)
+    now = time.monotonic()
+    hit = _DATABASES_CACHE.get(host)
+    if hit and hit[0] > now:
+        return hit[1]
+
+    dbs = _get_databases_uncached(server)
+    if dbs is not None:
+        _DATABASES_CACHE[host] = (now + ttl, dbs)
+    return dbs or []
+
+def _filter_databases(server, dbs):
+    # Filter out system databases
+    exclude = ["information_schema", "performance_schema", "mysql", "sys"]
+
+    # Add custom exclusions from server config
+    custom_exclude = server.get("exclude", [])
+    if isinstance(custom_exclude, list):
+        exclude.extend(custom_exclude)
+
+    return [db for db in dbs if db not in exclude]
+
+def _get_databases_uncached(server):
     host = server["host"]
     user = server["user"]
     password = server["password"]
+
+    # The pool connects when it is created, so an unreachable server fails there too
+    try:
+        pool = _server_pool(server)
+        if pool:
+            return _filter_databases(server, list_user_schemas(pool))
+    except mariadb.Error as e: # Only raised with the connector installed
+        print(f"{RED}Error fetching databases for {host}: {e}{RESET}")
+        return None
+
     port = server.get("port", 3306)
     container = server.get("container")
 
     try:
-        env = os.environ.copy()
-        env["MYSQL_PWD"] = password
+        env = _client_env(password, container)
         
         if container:
-            cmd = ["docker", "exec", "-e", f"MYSQL_PWD={password}", container, "mariadb", "-u", user, "-N", "-e", "SHOW DATABASES;"]
+            cmd = [get_tool("docker"), "exec", "-e", "MYSQL_PWD", container, "mariadb", "-u", user, "-N", "-e", "SHOW DATABASES;"]
         else:
-            cmd = ["mariadb", "-h", host, "-P", str(port), "-u", user, "-N", "-e", "SHOW DATABASES;"]
+            cmd = [get_tool("mariadb"), _defaults_file_option(password), "-h", host, "-P", str(port), "-u", user, "-N", "-e", "SHOW DATABASES;"]
         
-        p = subprocess.run(cmd, env=env if not container else None, capture_output=True, text=True)
+        p = subprocess.run(cmd, env=env, capture_output=True, text=True, **SPAWN_OPTIONS)
         if p.returncode != 0:
             print(f"{RED}Error fetching databases for {host}: {p.stderr.strip()}{RESET}")
-            return []
+            return None
         
-        dbs = p.stdout.strip().split('\n')
-        # Filter out system databases
-        exclude = ["information_schema", "performance_schema", "mysql", "sys"]
-        
-        # Add custom exclusions from server config
-        custom_exclude = server.get("exclude", [])
-        if isinstance(custom_exclude, list):
-            exclude.extend(custom_exclude)
-            
-        return [db for db in dbs if db not in exclude]
+        return _filter_databases(server, p.stdout.strip().split('\n'))
     except Exception as e:
         print(f"{RED}Error fetching databases for {host}: {e}{RESET}")
-        return []
+        return None
 
-def run_backup(config, host, user, password, db_name, port=3306, container=None, timeout=3600):
-    storage_path = Path(config.get("storage", {}).get("path", "./backups"))
-    db_backup_dir = storage_path / host
+def run_backup(config, host, user, password, db_name, port=3306, container=None, timeout=3600, dump_options=None, notifications=None):
+    db_backup_dir = _host_dir(config, host)
     db_backup_dir.mkdir(parents=True, exist_ok=True)
 
     date_str = datetime.datetime.now().strftime("%d-%m-%Y")
+    extension = get_backup_extension(config)
     
-    # Handle multiple backups on same day
-    existing_backups = glob.glob(str(db_backup_dir / f"{db_name}-{date_str}-*.sql.gz"))
+    # Handle multiple backups on same day, regardless of which compressor wrote them.
+    # Only names starting with the exact db-date prefix qualify, so a plain slice gives N.
+    prefix = f"{db_name}-{date_str}-"
+    extensions = tuple(BACKUP_EXTENSIONS.values())
     n = 1
-    if existing_backups:
-        # Extract N from filenames and find max
-        nums = []
-        for b in existing_backups:
-            try:
-                num_part = Path(b).name.split("-")[-1].split(".")[0]
-                nums.append(int(num_part))
-            except (ValueError, IndexError):
-                continue
-        if nums:
-            n = max(nums) + 1
+    for name, _, _ in _host_index(db_backup_dir):
+        if not name.startswith(prefix) or not name.endswith(extensions):
+            continue
+        try:
+            counter = int(name[len(prefix):].split(".", 1)[0])
+        except ValueError:
+            continue
+        if counter >= n:
+            n = counter + 1
 
-    filename = f"{db_name}-{date_str}-{n}.sql.gz"
-    filepath = db_backup_dir / filename
+    # Created exclusively, so a stale listing (another process, coarse directory mtimes)
+    # moves on to the next counter instead of truncating an existing backup
+    while True:
+        filename = f"{db_name}-{date_str}-{n}{extension}"
+        filepath = db_backup_dir / filename
+        try:
+            f = open(filepath, "xb")
+            break
+        except FileExistsError:
+            n += 1
+    # Uncompressed dump when compression is deferred; hidden and never matched as a backup
+    raw_path = db_backup_dir / f".{filename}.partial"
+    defer_compression = config.get("storage", {}).get("defer_compression", False)
 
     print(f"{CYAN}Backing up {db_name} from {host} to {filepath} (timeout: {timeout}s)...{RESET}")
     
     try:
-        env = os.environ.copy()
-        env["MYSQL_PWD"] = password
+        env = _client_env(password, container)
         
         # Using pipe to gzip to save space immediately
-        dump_args = [db_name]
+        dump_args = get_dump_options(config, dump_options) + [db_name]
 
         if container:
-            # When using docker exec, we pass MYSQL_PWD to the environment inside the container
+            # docker exec forwards MYSQL_PWD from our environment into the container
             # We don't use -it because it's not an interactive shell
-            dump_cmd = ["docker", "exec", "-e", f"MYSQL_PWD={password}", container, "mariadb-dump", "-h", host, "-P", str(port), "-u", user] + dump_args
+            dump_cmd = [get_tool("docker"), "exec", "-e", "MYSQL_PWD", container, "mariadb-dump", "-h", host, "-P", str(port), "-u", user] + dump_args
         else:
-            dump_cmd = ["mariadb-dump", "-h", host, "-P", str(port), "-u", user] + dump_args
+            # Compress the client/server protocol, dumps over the network are usually bandwidth-bound.
+            # Over loopback it would only burn CPU on both ends.
+            wire_compression = config.get("storage", {}).get("wire_compression", True) and not _is_loopback(host)
+            wire_args = ["--compress"] if wire_compression else []
+            dump_cmd = [get_tool("mariadb-dump"), _defaults_file_option(password), "-h", host, "-P", str(port), "-u", user] + wire_args + dump_args
         
-        gzip_cmd = ["gzip"]
+        gzip_cmd = get_compress_command(config)
+        upload_cmd = get_upload_command(config, host, db_name, filename)
         
-        with open(filepath, "wb") as f:
-            p1 = subprocess.Popen(dump_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env if not container else None)
-            p2 = subprocess.Popen(gzip_cmd, stdin=p1.stdout, stdout=f)
-            p1.stdout.close()
+        # stderr goes to a temp file so nothing has to drain it while the dump streams
+        with f, tempfile.TemporaryFile() as stderr_file, tempfile.TemporaryFile() as upload_stderr:
+            p3 = copier = None
+            if defer_compression:
+                # Dump at full speed to an uncompressed file and compress it afterwards
+                with open(raw_path, "wb") as raw:
+                    p1 = subprocess.Popen(dump_cmd, stdout=raw, stderr=stderr_file, env=env, **SPAWN_OPTIONS)
+                p2 = None
+            else:
+                p1 = subprocess.Popen(dump_cmd, stdout=subprocess.PIPE, stderr=stderr_file, env=env, **SPAWN_OPTIONS)
+                try:
+                    _enlarge_pipe(p1.stdout)
+                    p2, p3, copier = _start_compressor(gzip_cmd, p1.stdout, f, upload_cmd, upload_stderr)
+                except BaseException:
+                    # The dump would block forever on a pipe nobody reads, holding its
+                    # snapshot open on the server
+                    _kill_all(p1)
+                    raise
+                finally:
+                    p1.stdout.close()
             
-            # Wait for p1 to finish or timeout
+            # One deadline covers the dump and the compressor, so a stuck compressor can't
+            # hang a backup after the dump has finished
+            deadline = time.monotonic() + timeout
             try:
-                _, stderr = p1.communicate(timeout=timeout)
+                p1.wait(timeout=timeout)
+                if p2 is None and p1.returncode == 0:
+                    with open(raw_path, "rb") as raw:
+                        p2, p3, copier = _start_compressor(gzip_cmd, raw, f, upload_cmd, upload_stderr)
+                if p2:
+                    p2.wait(timeout=max(0, deadline - time.monotonic()))
             except subprocess.TimeoutExpired:
-                p1.kill()
-                p2.kill()
+                _kill_all(p1, p2, p3)
                 raise Exception(f"Backup process timed out after {timeout} seconds.")
-            
-            p2.wait()
 
-        if p1.returncode != 0:
-            raise Exception(stderr.decode().strip())
-        
-        if p2.returncode != 0:
-            raise Exception("Compression failed.")
+            # The copier never waits on the upload, so the local file is complete as soon
+            # as the compressor has exited
+            if copier:
+                copier.written.wait()
+                if copier.error:
+                    _kill_all(p3)
+                    raise Exception(f"Writing {filepath} failed: {copier.error}")
+
+            # A failed dump or compressor is reported right away, without waiting for the upload
+            if p1.returncode != 0:
+                _kill_all(p3)
+                stderr_file.seek(0)
+                raise Exception(stderr_file.read().decode(errors="replace").strip())
+            if p2.returncode != 0:
+                _kill_all(p3)
+                raise Exception("Compression failed.")
+
+            # A stuck upload is killed at the same deadline, but the local backup is complete
+            # by now and is kept; the upload is reported as failed below
+            upload_error = None
+            if p3:
+                try:
+                    p3.wait(timeout=max(0, deadline - time.monotonic()))
+                except subprocess.TimeoutExpired:
+                    _kill_all(p3)
+                    upload_error = f"timed out after {timeout} seconds"
+                if copier.upload_error:
+                    upload_error = copier.upload_error
+                elif p3.returncode != 0 and not upload_error:
+                    upload_stderr.seek(0)
+                    upload_error = upload_stderr.read().decode(errors="replace").strip() or f"exit status {p3.returncode}"
+
+        # The new backup grew after the directory last changed, so a listing taken
+        # meanwhile (e.g. by a parallel backup of this host) has a stale size for it
+        _invalidate_host_index(db_backup_dir)
 
         print(f"{GREEN}Backup completed: {filepath}{RESET}")
         
         success_msg = config.get("discord", {}).get("on_success", "Backup of {database} on {host} completed successfully.")
-        send_discord_notification(config, success_msg.format(database=db_name, host=host))
+        _notify(config, success_msg.format(database=db_name, host=host), notifications)
+
+        if upload_error:
+            # The local backup is fine, so it is kept and retention still runs
+            print(f"{RED}Upload failed: {upload_error}{RESET}")
+            upload_msg = config.get("discord", {}).get("on_upload_failure", "Upload of {database} on {host} failed: {error}")
+            _notify(config, upload_msg.format(database=db_name, host=host, error=upload_error), notifications)
         
         apply_retention(config, host, db_name)
 
     except Exception as e:
         error_str = str(e)
-        if "[Errno 2] No such file or directory: 'mariadb-dump'" in error_str:
-            error_str = "mariadb-dump not found. Please install mariadb-client or configure to use docker exec."
         print(f"{RED}Backup failed: {error_str}{RESET}")
         failure_msg = config.get("discord", {}).get("on_failure", "Backup of {database} on {host} failed: {error}")
-        send_discord_notification(config, failure_msg.format(database=db_name, host=host, error=error_str))
+        _notify(config, failure_msg.format(database=db_name, host=host, error=error_str), notifications)
+        f.close() # Still open if the backup failed before the dump started
         if filepath.exists():
             filepath.unlink()
+        # The database may have been dropped or renamed; look it up again next time
+        _DATABASES_CACHE.pop(host, None)
+        _invalidate_host_index(db_backup_dir)
+    finally:
+        if raw_path.exists():
+            raw_path.unlink()
 
 def list_backups(config):
-    storage_path = Path(config.get("storage", {}).get("path", "./backups"))
+    storage_path = _storage_path(config)
     if not storage_path.exists():
         print(f"{YELLOW}No backups found.{RESET}")
         return
@@ -219,22 +876,47 @@ def list_backups(config):
     print(f"{CYAN}{'Host':<30} {'Backup Name':<50} {'Size':<10} {'Date':<20}{RESET}")
     print("-" * 110)
     
-    for host_dir in storage_path.iterdir():
-        if host_dir.is_dir():
-            for backup_file in sorted(host_dir.glob("*.sql.gz")):
-                size_mb = backup_file.stat().st_size / (1024 * 1024)
-                mtime = datetime.datetime.fromtimestamp(backup_file.stat().st_mtime).strftime("%Y-%m-%d %H:%M:%S")
-                # Format for restore command: host/backup_name (without extension)
-                print(f"{host_dir.name:<30} {backup_file.name:<50} {size_mb:>8.2f} MB {mtime:<20}")
+    # Rows are collected and written at once rather than one print per backup
+    rows = []
+    with os.scandir(storage_path) as it:
+        host_dirs = [e for e in it if e.is_dir()]
+    for host_dir in host_dirs:
+        for name, size, st_mtime in sorted(_host_index(host_dir.path)):
+            size_mb = size / (1024 * 1024)
+            mtime = datetime.datetime.fromtimestamp(st_mtime).strftime("%Y-%m-%d %H:%M:%S")
+            # Format for restore command: host/backup_name (without extension)
+            rows.append(f"{host_dir.name:<30} {name:<50} {size_mb:>8.2f} MB {mtime:<20}\n")
+    sys.stdout.writelines(rows)
+
+def _drop_tables_pooled(pool, db_name):
+    try:
+        tables = _pooled_query(pool, [("SELECT table_name FROM information_schema.tables WHERE table_schema = ?", (db_name,))])
+    except mariadb.Error as e:
+        print(f"{RED}Warning: Failed to get tables list: {e}{RESET}")
+        return
+    if not tables:
+        return
+
+    # The pool resets the session when the connection is returned, so FOREIGN_KEY_CHECKS never leaks
+    statements = [("SET FOREIGN_KEY_CHECKS = 0", ())]
+    statements += [(f"DROP TABLE IF EXISTS `{db_name}`.`{table}`", ()) for table in tables]
+    statements.append(("SET FOREIGN_KEY_CHECKS = 1", ()))
+    try:
+        _pooled_query(pool, statements)
+    except mariadb.Error as e:
+        print(f"{RED}Warning: Failed to drop tables: {e}{RESET}")
 
 def restore_backup(config, backup_ref, clean_restore=False):
     # backup_ref format: db_server_one_FQDN/database-DD-MM-YYYY-N
     try:
         host, backup_name = backup_ref.split("/")
-        if not backup_name.endswith(".sql.gz"):
-             backup_file_path = Path(config.get("storage", {}).get("path", "./backups")) / host / f"{backup_name}.sql.gz"
+        host_dir = _host_dir(config, host)
+        if not backup_name.endswith(tuple(BACKUP_EXTENSIONS.values())):
+             # No extension given, use whichever compressed variant exists
+             candidates = [host_dir / f"{backup_name}{ext}" for ext in BACKUP_EXTENSIONS.values()]
+             backup_file_path = next((c for c in candidates if c.exists()), candidates[0])
         else:
-             backup_file_path = Path(config.get("storage", {}).get("path", "./backups")) / host / backup_name
+             backup_file_path = host_dir / backup_name
     except ValueError:
         print(f"{RED}Invalid backup reference format. Use host/backup_name{RESET}")
         return
@@ -243,15 +925,16 @@ def restore_backup(config, backup_ref, clean_restore=False):
         print(f"{RED}Backup file not found: {backup_file_path}{RESET}")
         return
 
-    db_name = backup_name.split("-")[0]
-    
+    # The database name is everything before -DD-MM-YYYY-N, and may itself contain dashes
+    match = _BACKUP_RE.match(backup_file_path.name)
+    if not match:
+        print(f"{RED}Not a backup file name (expected database-DD-MM-YYYY-N): {backup_file_path.name}{RESET}")
+        return
+    db_name = match["db"]
+
     # Find server config for this host
-    server_cfg = None
-    for s in config.get("servers", []):
-        if s["host"] == host:
-            server_cfg = s
-            break
-    
+    server_cfg = _servers_by_host(config).get(host)
+
     if not server_cfg:
         print(f"{RED}No server configuration found for host {host}{RESET}")
         return
@@ -259,54 +942,81 @@ def restore_backup(config, backup_ref, clean_restore=False):
     print(f"{CYAN}Restoring {db_name} on {host} from {backup_file_path}...{RESET}")
     
     try:
-        env = os.environ.copy()
-        env["MYSQL_PWD"] = server_cfg['password']
+        env = _client_env(server_cfg["password"], server_cfg.get("container"))
 
         if clean_restore:
             print(f"{YELLOW}Clean restore requested. Dropping all tables in {db_name}...{RESET}")
-            # Get list of tables and drop them one by one or via a script
-            if server_cfg.get("container"):
-                get_tables_cmd = ["docker", "exec", "-e", f"MYSQL_PWD={server_cfg['password']}", server_cfg["container"], "mariadb", "-u", server_cfg["user"], "-N", "-e", f"SHOW TABLES FROM `{db_name}`;"]
+            pool = _server_pool(server_cfg)
+            if pool:
+                _drop_tables_pooled(pool, db_name)
             else:
-                get_tables_cmd = ["mariadb", "-h", host, "-P", str(server_cfg.get("port", 3306)), "-u", server_cfg["user"], "-N", "-e", f"SHOW TABLES FROM `{db_name}`;"]
+                # Get list of tables and drop them one by one or via a script
+                if server_cfg.get("container"):
+                    get_tables_cmd = [get_tool("docker"), "exec", "-e", "MYSQL_PWD", server_cfg["container"], "mariadb", "-u", server_cfg["user"], "-N", "-e", f"SHOW TABLES FROM `{db_name}`;"]
+                else:
+                    get_tables_cmd = [get_tool("mariadb"), _defaults_file_option(server_cfg["password"]), "-h", host, "-P", str(server_cfg.get("port", 3306)), "-u", server_cfg["user"], "-N", "-e", f"SHOW TABLES FROM `{db_name}`;"]
             
-            p_tables = subprocess.run(get_tables_cmd, env=env if not server_cfg.get("container") else None, capture_output=True, text=True)
-            if p_tables.returncode == 0:
-                tables = p_tables.stdout.strip().split('\n')
-                if tables and tables[0]:
-                    drop_sql = "SET FOREIGN_KEY_CHECKS = 0; "
-                    for table in tables:
-                        drop_sql += f"DROP TABLE IF EXISTS `{db_name}`.`{table}`; "
-                    drop_sql += "SET FOREIGN_KEY_CHECKS = 1;"
-                    
-                    if server_cfg.get("container"):
-                        drop_cmd = ["docker", "exec", "-e", f"MYSQL_PWD={server_cfg['password']}", server_cfg["container"], "mariadb", "-u", server_cfg["user"], "-e", drop_sql]
-                    else:
-                        drop_cmd = ["mariadb", "-h", host, "-P", str(server_cfg.get("port", 3306)), "-u", server_cfg["user"], "-e", drop_sql]
-                    
-                    p_drop = subprocess.run(drop_cmd, env=env if not server_cfg.get("container") else None, capture_output=True)
-                    if p_drop.returncode != 0:
-                        print(f"{RED}Warning: Failed to drop tables: {p_drop.stderr.decode().strip()}{RESET}")
-            else:
-                 print(f"{RED}Warning: Failed to get tables list: {p_tables.stderr.strip()}{RESET}")
+                p_tables = subprocess.run(get_tables_cmd, env=env, capture_output=True, text=True)
+                if p_tables.returncode == 0:
+                    tables = p_tables.stdout.strip().split('\n')
+                    if tables and tables[0]:
+                        # Fed through stdin: thousands of tables would not fit on the command line
+                        drop_sql = "\n".join(
+                            ["SET FOREIGN_KEY_CHECKS = 0;"]
+                            + [f"DROP TABLE IF EXISTS `{db_name}`.`{table}`;" for table in tables]
+                            + ["SET FOREIGN_KEY_CHECKS = 1;", ""]
+                        )
+
+                        if server_cfg.get("container"):
+                            drop_cmd = [get_tool("docker"), "exec", "-i", "-e", "MYSQL_PWD", server_cfg["container"], "mariadb", "-u", server_cfg["user"]]
+                        else:
+                            drop_cmd = [get_tool("mariadb"), _defaults_file_option(server_cfg["password"]), "-h", host, "-P", str(server_cfg.get("port", 3306)), "-u", server_cfg["user"]]
 
-        # zcat backup.sql.gz | mariadb -h host -P port -u user db_name
-        zcat_cmd = ["zcat", str(backup_file_path)]
+                        p_drop = subprocess.run(drop_cmd, env=env, input=drop_sql.encode(), capture_output=True)
+                        if p_drop.returncode != 0:
+                            print(f"{RED}Warning: Failed to drop tables: {p_drop.stderr.decode().strip()}{RESET}")
+                else:
+                     print(f"{RED}Warning: Failed to get tables list: {p_tables.stderr.strip()}{RESET}")
+
+        # pigz -dc backup.sql.gz | mariadb -h host -P port -u user db_name
+        decompress_cmd = get_decompress_command(backup_file_path)
         
         if server_cfg.get("container"):
              # We use -i for piping stdin, but NOT -t
-             mysql_cmd = ["docker", "exec", "-i", "-e", f"MYSQL_PWD={server_cfg['password']}", server_cfg["container"], "mariadb", "-u", server_cfg["user"], db_name]
+             mysql_cmd = [get_tool("docker"), "exec", "-i", "-e", "MYSQL_PWD", server_cfg["container"], "mariadb", "-u", server_cfg["user"], f"--max-allowed-packet={MAX_ALLOWED_PACKET}", db_name]
         else:
-             mysql_cmd = ["mariadb", "-h", host, "-P", str(server_cfg.get("port", 3306)), "-u", server_cfg["user"], db_name]
+             mysql_cmd = [get_tool("mariadb"), _defaults_file_option(server_cfg["password"]), "-h", host, "-P", str(server_cfg.get("port", 3306)), "-u", server_cfg["user"], f"--max-allowed-packet={MAX_ALLOWED_PACKET}", db_name]
         
-        p1 = subprocess.Popen(zcat_cmd, stdout=subprocess.PIPE)
-        p2 = subprocess.Popen(mysql_cmd, stdin=p1.stdout, stderr=subprocess.PIPE, env=env if not server_cfg.get("container") else None)
-        p1.stdout.close()
-        _, stderr = p2.communicate()
+        if decompress_cmd:
+            p1 = subprocess.Popen(decompress_cmd, stdout=subprocess.PIPE)
+            _enlarge_pipe(p1.stdout)
+            p2 = subprocess.Popen(mysql_cmd, stdin=p1.stdout, stderr=subprocess.PIPE, env=env)
+            p1.stdout.close()
+            _, stderr = p2.communicate()
+            p1.wait()
+        else:
+            # No pigz: decompress with the gzip module and stream into the client.
+            # A GzipFile can't be passed as stdin directly, its fileno() is the compressed file.
+            p1 = None
+            p2 = subprocess.Popen(mysql_cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+            _enlarge_pipe(p2.stdin)
+            try:
+                with gzip.open(backup_file_path, "rb") as gz:
+                    shutil.copyfileobj(gz, p2.stdin, PIPE_BUFFER_SIZE)
+            except BrokenPipeError:
+                pass # Client exited early, its stderr explains why
+            except Exception:
+                p2.kill()
+                p2.wait()
+                raise
+            _, stderr = p2.communicate()
 
         if p2.returncode != 0:
             raise Exception(stderr.decode().strip())
 
+        if p1 and p1.returncode != 0:
+            raise Exception("Decompression failed.")
+
         print(f"{GREEN}Restore completed successfully.{RESET}")
         
         success_msg = config.get("discord", {}).get("on_restore_success", "Restore of {database} on {host} completed successfully.")
@@ -317,45 +1027,355 @@ def restore_backup(config, backup_ref, clean_restore=False):
         failure_msg = config.get("discord", {}).get("on_restore_failure", "Restore of {database} on {host} failed: {error}")
         send_discord_notification(config, failure_msg.format(database=db_name, host=host, error=error_str))
 
-def run_all_now(config):
+def _server_jobs(server):
+    # [(db_name, timeout)] for the server's database entries
+    databases = server.get("databases", [])
+    if not databases:
+        databases = ["all"]
+
+    jobs = []
+    for db_entry in databases:
+        db_name = db_entry
+        db_timeout = server.get("timeout", 3600)
+
+        if isinstance(db_entry, dict):
+            db_name = db_entry.get("name")
+            db_timeout = db_entry.get("timeout", db_timeout)
+
+        jobs.append((db_name, db_timeout))
+    return jobs
+
+def _index_servers(servers):
+    by_host = {}
+    for s in servers:
+        if "host" in s: # A server without one is reported when it is backed up
+            by_host.setdefault(s["host"], s) # First entry wins, as with a linear search
+    return by_host
+
+def _servers_by_host(config):
+    by_host = config.get("_by_host")
+    if by_host is None:
+        by_host = _index_servers(config.get("servers", []))
+    return by_host
+
+def _normalize_config(config):
+    # Precomputes lookups the daemon and restore would otherwise redo on every use.
+    # Safe to call again on the same (cached) config.
+    config["_by_host"] = _index_servers(config.get("servers", []))
+    config["_storage"] = Path(config.get("storage", {}).get("path", "./backups"))
+    config["_host_dirs"] = {host: config["_storage"] / host for host in config["_by_host"]}
     for server in config.get("servers", []):
-        databases = server.get("databases", [])
-        if not databases:
-            databases = ["all"]
+        server["_jobs"] = _server_jobs(server)
+        server.pop("_schedule", None)
+        if "schedule" in server:
+            try:
+                server["_schedule"] = datetime.datetime.strptime(server["schedule"], "%H:%M").time()
+            except (TypeError, ValueError):
+                pass # Reported by get_next_run_time when the daemon schedules it
+        server.pop("_interval", None)
+        if "interval_hours" in server:
+            try:
+                server["_interval"] = datetime.timedelta(hours=server["interval_hours"])
+            except (TypeError, ValueError, OverflowError):
+                pass # Reported by get_next_run_time when the daemon schedules it
+    return config
 
-        for db_entry in databases:
-            db_name = db_entry
-            db_timeout = server.get("timeout", 3600)
-            
-            if isinstance(db_entry, dict):
-                db_name = db_entry.get("name")
-                db_timeout = db_entry.get("timeout", db_timeout)
-            
-            if db_name == "all":
-                server_dbs = get_databases(server)
-                for sdb in server_dbs:
-                    run_backup(
-                        config, 
-                        server["host"], 
-                        server["user"], 
-                        server["password"], 
-                        sdb, 
-                        port=server.get("port", 3306),
-                        container=server.get("container"),
-                        timeout=db_timeout
-                    )
+def _backup_jobs(config):
+    # (server, db_name, timeout) for every configured database entry; "all" is left
+    # for the caller to expand so it can decide when to query the server
+    for server in config.get("servers", []):
+        jobs = server.get("_jobs")
+        if jobs is None:
+            jobs = _server_jobs(server)
+        for db_name, db_timeout in jobs:
+            yield server, db_name, db_timeout
+
+def _run_backup_job(config, server, db_name, db_timeout, notifications=None):
+    # One backup per database at a time so the file counter and retention never race
+    with _DB_LOCKS[(server["host"], db_name)]:
+        run_backup(
+            config, 
+            server["host"], 
+            server["user"], 
+            server["password"], 
+            db_name, 
+            port=server.get("port", 3306),
+            container=server.get("container"),
+            timeout=db_timeout,
+            dump_options=server.get("dump_options"),
+            notifications=notifications
+        )
+
+class _BackupPool:
+    # Runs backups on a thread pool, at most "parallel" per host so a shared server isn't
+    # overloaded. Jobs wait for a host slot in a per-host queue rather than on a worker,
+    # so a host with many databases never keeps the other hosts from starting.
+    def __init__(self, max_workers):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="backup")
+        self._lock = threading.Lock()
+        self._active = defaultdict(int) # host -> jobs holding one of its slots
+        self._queued = defaultdict(deque) # host -> (future, job) waiting for a slot
+        self._futures = set() # Futures not done yet
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def submit(self, config, server, db_name, db_timeout, notifications=None):
+        # Returns a Future for the backup, like ThreadPoolExecutor.submit
+        future = Future()
+        job = (config, server, db_name, db_timeout, notifications)
+        host = server["host"]
+        with self._lock:
+            self._futures.add(future)
+            if self._active[host] >= max(1, server.get("parallel", 1)):
+                self._queued[host].append((future, job))
+                return future
+            self._active[host] += 1
+        self._executor.submit(self._run, host, future, job)
+        return future
+
+    def _run(self, host, future, job):
+        running = future.set_running_or_notify_cancel() # False once cancelled
+        error = None
+        if running:
+            try:
+                _run_backup_job(*job)
+            except BaseException as e:
+                error = e
+        # The slot is handed on before the future completes, so once every future
+        # is done nothing new reaches the executor (see shutdown)
+        self._release(host)
+        with self._lock:
+            self._futures.discard(future)
+        if not running:
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(None)
+
+    def _release(self, host):
+        with self._lock:
+            queue = self._queued[host]
+            if not queue:
+                self._active[host] -= 1
+                return
+            future, job = queue.popleft()
+        self._executor.submit(self._run, host, future, job)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        # Like ThreadPoolExecutor.shutdown; with cancel_futures, backups that haven't
+        # started are cancelled. Waiting includes the jobs still queued for a host slot.
+        dropped = []
+        with self._lock:
+            if cancel_futures:
+                for queue in self._queued.values():
+                    dropped.extend(future for future, _ in queue)
+                    queue.clear()
+            futures = list(self._futures)
+        if cancel_futures:
+            for future in futures:
+                future.cancel() # A no-op for running backups
+            for future in dropped:
+                # These never reach _run, which would otherwise mark them as done
+                future.set_running_or_notify_cancel()
+        if wait:
+            wait_futures(futures)
+            self._executor.shutdown(wait=True)
+
+def _backup_pool(config):
+    # Backups mostly wait on subprocesses, so threads overlap them well
+    parallelism = config.get("storage", {}).get("parallelism") or os.cpu_count() or 1
+    return _BackupPool(parallelism)
+
+@contextlib.contextmanager
+def _cancel_on_exit(executor):
+    # On SIGTERM (see _terminate) or Ctrl-C only the running backups are waited for;
+    # queued ones would start after their option files are gone. _BackupPool cancels
+    # them itself, ThreadPoolExecutor's cancel_futures needs Python 3.9.
+    try:
+        yield
+    except BaseException:
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+
+def _report_job_failure(config, server, db_name, error, notifications=None):
+    # For errors escaping run_backup, which reports its own failures
+    print(f"{RED}Backup of {db_name} on {server['host']} failed: {error}{RESET}")
+    failure_msg = config.get("discord", {}).get("on_failure", "Backup of {database} on {host} failed: {error}")
+    _notify(config, failure_msg.format(database=db_name, host=server["host"], error=str(error)), notifications)
+
+def _report_daemon_job(config, server, db_name, future):
+    # Done callback of the daemon's backups, nothing else ever looks at their results
+    if not future.cancelled() and future.exception() is not None:
+        _report_job_failure(config, server, db_name, future.exception())
+
+def run_all_now(config):
+    jobs = []
+    for server, db_name, db_timeout in _backup_jobs(config):
+        if db_name == "all":
+            for sdb in get_databases(server):
+                jobs.append((server, sdb, db_timeout))
+            continue
+
+        jobs.append((server, db_name, db_timeout))
+
+    # One batch of results, so the webhook gets one summary instead of a post per database
+    notifications = NotificationBuffer()
+    with _backup_pool(config) as executor, _cancel_on_exit(executor):
+        futures = {executor.submit(config, *job, notifications): job for job in jobs}
+        for future in as_completed(futures):
+            # run_backup reports its own failures; anything escaping it must not
+            # stop the remaining results from being collected and sent
+            try:
+                future.result()
+            except Exception as e:
+                server, db_name, _ = futures[future]
+                _report_job_failure(config, server, db_name, e, notifications)
+    notifications.flush(config)
+
+def get_next_run_time(server, now, last_run=None):
+    # When a server's backups are next due, or None if it has no schedule.
+    # Raises ValueError for a malformed "schedule" or "interval_hours".
+    if "schedule" in server:
+        # Daily at set time HH:MM; a time already passed today is due right away at startup
+        sched_time = server.get("_schedule")
+        if sched_time is None:
+            try:
+                sched_time = datetime.datetime.strptime(server["schedule"], "%H:%M").time()
+            except TypeError as e:
+                raise ValueError(str(e))
+        if last_run is None:
+            return datetime.datetime.combine(now.date(), sched_time)
+        next_run = datetime.datetime.combine(last_run.date(), sched_time)
+        if next_run <= last_run:
+            next_run += datetime.timedelta(days=1)
+        return next_run
+    if "interval_hours" in server:
+        interval = server.get("_interval")
+        if interval is None:
+            try:
+                interval = datetime.timedelta(hours=server["interval_hours"])
+            except (TypeError, OverflowError) as e:
+                raise ValueError(str(e))
+        if last_run is None:
+            return now
+        return last_run + interval
+    return None
+
+def _schedule_backups(config, now, last_runs, seq):
+    # Min-heap of (due, seq, server, db_name, timeout); seq breaks ties between equal due times.
+    # Entries that already ran are due relative to their last run, so a reload doesn't rerun them.
+    heap = []
+    for server, db_name, db_timeout in _backup_jobs(config):
+        try:
+            due = get_next_run_time(server, now, last_runs.get((server["host"], db_name)))
+        except ValueError:
+            setting = "schedule" if "schedule" in server else "interval_hours"
+            print(f"{RED}Invalid {setting} for {server['host']}/{db_name}: {server[setting]!r}{RESET}")
+            continue
+        if due is not None:
+            heapq.heappush(heap, (due, next(seq), server, db_name, db_timeout))
+    return heap
+
+def _reload_config(config, heap, config_path, last_runs, seq):
+    # Returns the new (config, heap), or the old ones when the file can't be used,
+    # so a bad edit never stops the running daemon
+    try:
+        new_config = load_config(config_path)
+        if not isinstance(new_config, dict):
+            raise ValueError("expected a mapping of settings")
+        new_config = _normalize_config(new_config)
+        new_heap = _schedule_backups(new_config, datetime.datetime.now(), last_runs, seq)
+    except SystemExit: # load_config already printed why
+        print(f"{RED}Keeping the previous configuration.{RESET}")
+        return config, heap
+    except Exception as e:
+        print(f"{RED}Invalid {config_path}: {e!r}. Keeping the previous configuration.{RESET}")
+        return config, heap
+    print(f"{GREEN}Reloaded {config_path}.{RESET}")
+    return new_config, new_heap
+
+def _request_reload(signum, frame):
+    # Only a write to a non-blocking pipe: the interrupted code may hold any lock, e.g. an
+    # Event's, so taking one here could deadlock. A full pipe already has a reload pending.
+    try:
+        os.write(_RELOAD_PIPE[1], b"\0")
+    except BlockingIOError:
+        pass
+
+def _wait_for_reload(timeout=None):
+    # Sleeps up to timeout seconds (None: until a reload), True when a reload was requested
+    if _RELOAD_PIPE is None:
+        time.sleep(DAEMON_MAX_SLEEP if timeout is None else timeout)
+        return False
+    ready, _, _ = select.select([_RELOAD_PIPE[0]], [], [], timeout)
+    if not ready:
+        return False
+    try:
+        while os.read(_RELOAD_PIPE[0], 4096): # Several SIGHUPs are one reload
+            pass
+    except BlockingIOError:
+        pass
+    return True
+
+def run_daemon(config, config_path="config.yml"):
+    print(f"{GREEN}Starting backup daemon...{RESET}")
+    last_runs = {} # (host, db_name) -> start of its last run
+    seq = itertools.count()
+    heap = _schedule_backups(config, datetime.datetime.now(), last_runs, seq)
+
+    if not heap:
+        print(f"{YELLOW}No scheduled backups configured (set 'schedule' or 'interval_hours').{RESET}")
+        return
+
+    global _RELOAD_PIPE
+    if hasattr(signal, "SIGHUP") and _RELOAD_PIPE is None: # Not available on Windows
+        _RELOAD_PIPE = os.pipe()
+        for fd in _RELOAD_PIPE:
+            os.set_blocking(fd, False)
+        signal.signal(signal.SIGHUP, _request_reload)
+
+    reload = False
+
+    running = {} # (host, db_name) -> futures of its last run
+    # The pool keeps the parallelism it was started with; changing it needs a restart
+    with _backup_pool(config) as executor, _cancel_on_exit(executor):
+        while True:
+            if reload:
+                reload = False
+                config, heap = _reload_config(config, heap, config_path, last_runs, seq)
+            if not heap:
+                print(f"{YELLOW}No scheduled backups configured, waiting for a reload (SIGHUP).{RESET}")
+                reload = _wait_for_reload()
                 continue
 
-            run_backup(
-                config, 
-                server["host"], 
-                server["user"], 
-                server["password"], 
-                db_name, 
-                port=server.get("port", 3306),
-                container=server.get("container"),
-                timeout=db_timeout
-            )
+            # Sleep until the next backup is due or a reload is requested,
+            # waking periodically to notice clock changes
+            delay = (heap[0][0] - datetime.datetime.now()).total_seconds()
+            if delay > 0:
+                reload = _wait_for_reload(min(delay, DAEMON_MAX_SLEEP))
+                continue
+
+            _, _, server, db_name, db_timeout = heapq.heappop(heap)
+            started = datetime.datetime.now()
+            key = (server["host"], db_name)
+            if any(not f.done() for f in running.get(key, [])):
+                print(f"{YELLOW}Skipping {server['host']}/{db_name}: previous run still in progress.{RESET}")
+            else:
+                # "all" is expanded when it fires so new databases are picked up
+                server_dbs = get_databases(server) if db_name == "all" else [db_name]
+                running[key] = []
+                for sdb in server_dbs:
+                    future = executor.submit(config, server, sdb, db_timeout)
+                    future.add_done_callback(functools.partial(_report_daemon_job, config, server, sdb))
+                    running[key].append(future)
+            # Scheduled from submission time, the same as the serial loop it replaces
+            last_runs[key] = started
+            heapq.heappush(heap, (get_next_run_time(server, started, started), next(seq), server, db_name, db_timeout))
 
 def main():
     parser = argparse.ArgumentParser(description="MariaDB Backup System")
@@ -375,104 +1395,23 @@ def main():
     subparsers.add_parser("daemon", help="Run the backup scheduler")
 
     args = parser.parse_args()
-    config = load_config()
+    config = _normalize_config(load_config())
 
     if args.command == "list":
         list_backups(config)
     elif args.command == "restore":
         restore_backup(config, args.backup_ref, clean_restore=args.clean)
-    elif args.command == "now":
-        run_all_now(config)
-    elif args.command == "daemon":
-        print(f"{GREEN}Starting backup daemon...{RESET}")
-        # Simple scheduling loop
-        last_run = {} # (host, db) -> last_run_time
-        
-        while True:
-            now = datetime.datetime.now()
-            for server in config.get("servers", []):
-                host = server["host"]
-                databases = server.get("databases", [])
-                if not databases:
-                    databases = ["all"]
-
-                for db_entry in databases:
-                    db_name = db_entry
-                    db_timeout = server.get("timeout", 3600)
-                    
-                    if isinstance(db_entry, dict):
-                        db_name = db_entry.get("name")
-                        db_timeout = db_entry.get("timeout", db_timeout)
-
-                    if db_name == "all":
-                        server_dbs = get_databases(server)
-                        for sdb in server_dbs:
-                            key = (host, sdb)
-                            
-                            # Check scheduling for each database
-                            should_run = False
-                            if "schedule" in server:
-                                try:
-                                    sched_time = datetime.datetime.strptime(server["schedule"], "%H:%M").time()
-                                    today_run_time = datetime.datetime.combine(now.date(), sched_time)
-                                    if now >= today_run_time:
-                                        if key not in last_run or last_run[key] < today_run_time:
-                                            should_run = True
-                                except ValueError:
-                                    print(f"{RED}Invalid schedule format for {host}/{sdb}: {server['schedule']}{RESET}")
-                            elif "interval_hours" in server:
-                                interval = datetime.timedelta(hours=server["interval_hours"])
-                                if key not in last_run or (now - last_run[key]) >= interval:
-                                    should_run = True
-                            
-                            if should_run:
-                                run_backup(
-                                    config, 
-                                    host, 
-                                    server["user"], 
-                                    server["password"], 
-                                    sdb, 
-                                    port=server.get("port", 3306),
-                                    container=server.get("container"),
-                                    timeout=db_timeout
-                                )
-                                last_run[key] = now
-                        continue
-
-                    should_run = False
-                    key = (host, db_name)
-                    
-                    if "schedule" in server:
-                        # Daily at set time HH:MM
-                        try:
-                            sched_time = datetime.datetime.strptime(server["schedule"], "%H:%M").time()
-                            today_run_time = datetime.datetime.combine(now.date(), sched_time)
-                            
-                            if now >= today_run_time:
-                                if key not in last_run or last_run[key] < today_run_time:
-                                    should_run = True
-                        except ValueError:
-                            print(f"{RED}Invalid schedule format for {host}/{db_name}: {server['schedule']}{RESET}")
-                    
-                    elif "interval_hours" in server:
-                        interval = datetime.timedelta(hours=server["interval_hours"])
-                        if key not in last_run or (now - last_run[key]) >= interval:
-                            should_run = True
-                    
-                    if should_run:
-                        run_backup(
-                            config, 
-                            host, 
-                            server["user"], 
-                            server["password"], 
-                            db_name, 
-                            port=server.get("port", 3306),
-                            container=server.get("container"),
-                            timeout=db_timeout
-                        )
-                        last_run[key] = now
-            
-            time.sleep(60)
+    elif args.command in ("now", "daemon"):
+        missing = find_missing_tools(config)
+        for problem in missing:
+            print(f"{RED}{problem}{RESET}")
+        if missing:
+            sys.exit(1)
+        signal.signal(signal.SIGTERM, _terminate)
+        if args.command == "now":
+            run_all_now(config)
+        else:
+            run_daemon(config)
     else:
         parser.print_help()
 
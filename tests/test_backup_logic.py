@@ -1,6 +1,7 @@
 import unittest
 import os
 import shutil
+import gzip
 import yaml
 import sys
 import time
@@ -36,6 +37,11 @@ class TestBackupLogic(unittest.TestCase):
         with open(self.config_file, "w") as f:
             yaml.dump(self.config, f)
 
+        # No test may reach a real webhook; tests that check posting patch it themselves
+        http_patch = patch('backup._SESSION.post')
+        http_patch.start()
+        self.addCleanup(http_patch.stop)
+
     def tearDown(self):
         print(f"{CYAN}Tearing down test: {self._testMethodName}{RESET}")
         if self.test_dir.exists():
@@ -53,6 +59,45 @@ class TestBackupLogic(unittest.TestCase):
         self.assertEqual(policy["keep_last"], 5)
         print(f"{GREEN}Result: Override policy correctly retrieved.{RESET}")
 
+    def test_load_config_cache(self):
+        print(f"{YELLOW}Action: Checking config caching by modification time...{RESET}")
+        config = load_config(str(self.config_file))
+        self.assertEqual(config, self.config)
+        self.assertIs(load_config(str(self.config_file)), config)
+        print(f"{GREEN}Result: Unchanged config is not parsed again.{RESET}")
+
+        with open(self.config_file, "w") as f:
+            yaml.dump({"storage": {"path": "elsewhere"}}, f)
+        st = self.config_file.stat()
+        os.utime(self.config_file, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+        self.assertEqual(load_config(str(self.config_file))["storage"]["path"], "elsewhere")
+        print(f"{GREEN}Result: Modified config is reloaded.{RESET}")
+
+    def test_reload_keeps_config_on_invalid_file(self):
+        from backup import _reload_config
+        import itertools
+        print(f"{YELLOW}Action: Reloading config files that parse but can't be used...{RESET}")
+        heap = []
+        invalid = [
+            "",
+            "- servers\n",
+            "servers:\n  - user: root\n    interval_hours: 6\n",
+        ]
+        for i, text in enumerate(invalid):
+            self.config_file.write_text(text)
+            os.utime(self.config_file, ns=(0, (i + 1) * 1_000_000_000))
+            new_config, new_heap = _reload_config(self.config, heap, str(self.config_file), {}, itertools.count())
+            self.assertIs(new_config, self.config)
+            self.assertIs(new_heap, heap)
+        print(f"{GREEN}Result: Previous config and schedule kept every time.{RESET}")
+
+        self.config_file.write_text("servers:\n  - host: a\n    interval_hours: 6\n")
+        os.utime(self.config_file, ns=(0, 10_000_000_000))
+        new_config, new_heap = _reload_config(self.config, heap, str(self.config_file), {}, itertools.count())
+        self.assertEqual(new_config["servers"][0]["host"], "a")
+        self.assertEqual(len(new_heap), 1)
+        print(f"{GREEN}Result: A valid file is still picked up.{RESET}")
+
     def test_apply_retention_count(self):
         print(f"{YELLOW}Action: Testing retention by count...{RESET}")
         host = "test_host"
@@ -60,13 +105,14 @@ class TestBackupLogic(unittest.TestCase):
         db_dir = self.test_dir / host
         db_dir.mkdir(parents=True)
 
-        # Create 5 dummy backup files with proper naming for the new glob pattern
+        # Create 5 empty backup files with proper naming for the new glob pattern
         # Pattern: db_name-DD-MM-YYYY-N.sql.gz
+        t0 = time.time()
         for i in range(5):
             f = db_dir / f"{db}-18-01-2026-{i}.sql.gz"
-            f.write_text("dummy content")
+            f.touch()
             # Ensure different mtimes
-            os.utime(f, (time.time() + i, time.time() + i))
+            os.utime(f, (t0 + i, t0 + i))
         
         print(f"Created 5 dummy backups in {db_dir}")
         
@@ -78,14 +124,521 @@ class TestBackupLogic(unittest.TestCase):
         self.assertEqual(len(remaining), 2)
         print(f"{GREEN}Result: Correctly kept only the last 2 backups.{RESET}")
 
-    @patch('requests.post')
+    def test_apply_retention_size(self):
+        print(f"{YELLOW}Action: Testing retention by size...{RESET}")
+        host = "test_host"
+        db = "test_db"
+        db_dir = self.test_dir / host
+        db_dir.mkdir(parents=True)
+
+        # 4 backups of 10 bytes with room for 25 bytes: only the 2 newest fit
+        config = dict(self.config, retention={"default": {"keep_last": 10, "max_gb": 25 / 1024**3}})
+        for i in range(4):
+            (db_dir / f"{db}-18-01-2026-{i}.sql.gz").write_bytes(b"0123456789")
+
+        apply_retention(config, host, db)
+
+        remaining = sorted(f.name for f in db_dir.glob(f"{db}-*.sql.gz"))
+        self.assertEqual(remaining, [f"{db}-18-01-2026-2.sql.gz", f"{db}-18-01-2026-3.sql.gz"])
+        print(f"{GREEN}Result: Oldest backups over the size limit were removed.{RESET}")
+
+    def test_apply_retention_orders_by_filename_date(self):
+        print(f"{YELLOW}Action: Testing retention ordering by the date in the filename...{RESET}")
+        host = "test_host"
+        db = "test_db"
+        db_dir = self.test_dir / host
+        db_dir.mkdir(parents=True)
+
+        # Newest by name gets the oldest mtime, e.g. after copying backups around
+        names = [f"{db}-31-12-2025-1.sql.gz", f"{db}-01-01-2026-1.sql.gz", f"{db}-01-01-2026-2.sql.gz"]
+        t0 = time.time()
+        for i, name in enumerate(names):
+            f = db_dir / name
+            f.touch()
+            os.utime(f, (t0 - i * 100, t0 - i * 100))
+
+        # Policy is keep_last: 2
+        apply_retention(self.config, host, db)
+
+        remaining = sorted(f.name for f in db_dir.glob(f"{db}-*.sql.gz"))
+        self.assertEqual(remaining, sorted(names[1:]))
+        print(f"{GREEN}Result: Oldest backup by filename date was removed.{RESET}")
+
+    @patch.dict('backup.TOOLS', {"mariadb": "/usr/bin/mariadb", "pigz": None})
+    @patch('backup.send_discord_notification')
+    @patch('backup.subprocess.Popen')
+    def test_restore_db_name_with_dashes(self, mock_popen, mock_notify):
+        from backup import restore_backup
+        print(f"{YELLOW}Action: Restoring a backup of a database with dashes in its name...{RESET}")
+        host_dir = self.test_dir / "localhost"
+        host_dir.mkdir(parents=True, exist_ok=True)
+        with gzip.open(host_dir / "my-app-01-01-2024-1.sql.gz", "wb") as f:
+            f.write(b"SELECT 1;")
+        mock_popen.return_value.communicate.return_value = (b"", b"")
+        mock_popen.return_value.returncode = 0
+        # The client's stdin needs a real pipe, restore_backup resizes it with fcntl
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+        mock_popen.return_value.stdin.fileno.return_value = write_fd
+
+        config = dict(self.config, servers=[{"host": "localhost", "user": "root", "password": "pw"}])
+        restore_backup(config, "localhost/my-app-01-01-2024-1")
+        self.assertEqual(mock_popen.call_args[0][0][-1], "my-app")
+        mock_notify.assert_called_once_with(config, "Restore of my-app on localhost completed successfully.")
+        print(f"{GREEN}Result: Restored into my-app, not my.{RESET}")
+
+    def test_host_index_reuse(self):
+        from backup import _host_index
+        print(f"{YELLOW}Action: Listing a host directory twice, then after adding a file...{RESET}")
+        host_dir = self.test_dir / "indexed"
+        host_dir.mkdir(parents=True, exist_ok=True)
+        (host_dir / "db-01-01-2024-1.sql.gz").write_bytes(b"x")
+        past = time.time() - 60
+        os.utime(host_dir, (past, past))
+
+        self.assertEqual([e[0] for e in _host_index(host_dir)], ["db-01-01-2024-1.sql.gz"])
+        with patch('backup.os.scandir', side_effect=AssertionError("directory rescanned")):
+            self.assertEqual(len(_host_index(host_dir)), 1)
+
+        (host_dir / "db-02-01-2024-1.sql.gz").write_bytes(b"x")
+        self.assertEqual(len(_host_index(host_dir)), 2)
+        print(f"{GREEN}Result: Unchanged directory served from the index, changes picked up.{RESET}")
+
+    def test_next_run_time(self):
+        from backup import get_next_run_time
+        import datetime
+        print(f"{YELLOW}Action: Checking daemon scheduling of the next run...{RESET}")
+        now = datetime.datetime(2026, 1, 18, 10, 0)
+        server = {"schedule": "02:00"}
+        self.assertEqual(get_next_run_time(server, now), datetime.datetime(2026, 1, 18, 2, 0))
+        self.assertEqual(get_next_run_time(server, now, now), datetime.datetime(2026, 1, 19, 2, 0))
+        self.assertEqual(
+            get_next_run_time(server, now, datetime.datetime(2026, 1, 18, 1, 0)),
+            datetime.datetime(2026, 1, 18, 2, 0)
+        )
+        print(f"{GREEN}Result: Daily schedule runs once per day at the set time.{RESET}")
+
+        server = {"interval_hours": 6}
+        self.assertEqual(get_next_run_time(server, now), now)
+        self.assertEqual(get_next_run_time(server, now, now), datetime.datetime(2026, 1, 18, 16, 0))
+        self.assertIsNone(get_next_run_time({}, now))
+        print(f"{GREEN}Result: Interval schedule runs every interval_hours.{RESET}")
+
+        with self.assertRaises(ValueError):
+            get_next_run_time({"interval_hours": "6h"}, now)
+        print(f"{GREEN}Result: A non-numeric interval_hours is a ValueError.{RESET}")
+
+    def test_normalize_config_bad_servers(self):
+        from backup import _normalize_config, list_backups
+        print(f"{YELLOW}Action: Listing backups with servers the daemon can't schedule...{RESET}")
+        config = dict(self.config, servers=[
+            {"host": "a", "interval_hours": "6h"},
+            {"user": "root", "schedule": "02:00"},
+        ])
+        config = _normalize_config(config)
+        self.assertEqual(list(config["_by_host"]), ["a"])
+        (self.test_dir / "a").mkdir()
+        list_backups(config)
+        print(f"{GREEN}Result: list still works, the daemon reports the servers.{RESET}")
+
+    def test_backup_pool_host_limits(self):
+        from backup import _BackupPool
+        import threading
+        print(f"{YELLOW}Action: Backing up 8 databases from one host and 2 from another on 4 workers...{RESET}")
+        order = []
+        running = {"a": 0}
+        peak = {"a": 0}
+        lock = threading.Lock()
+        b_started = threading.Event()
+        b_together = threading.Barrier(2, timeout=10) # Both of b's backups run at once
+        def fake_job(config, server, db_name, db_timeout, notifications=None):
+            host = server["host"]
+            with lock:
+                order.append((host, db_name))
+            if host == "b":
+                b_started.set()
+                b_together.wait()
+                return
+            with lock:
+                running[host] += 1
+                peak[host] = max(peak[host], running[host])
+            # Host a's first backup only finishes once host b has started
+            b_started.wait(timeout=10)
+            with lock:
+                running[host] -= 1
+        server_a, server_b = {"host": "a"}, {"host": "b", "parallel": 2}
+        with patch('backup._run_backup_job', side_effect=fake_job), _BackupPool(4) as pool:
+            futures = [pool.submit({}, server_a, f"db{i}", 60) for i in range(8)]
+            futures += [pool.submit({}, server_b, f"db{i}", 60) for i in range(2)]
+        self.assertTrue(all(f.done() and f.exception() is None for f in futures))
+        self.assertLess(order.index(("b", "db0")), order.index(("a", "db1")))
+        self.assertEqual(peak, {"a": 1})
+        print(f"{GREEN}Result: Host b started while host a was busy, per-host limits kept.{RESET}")
+
+    @patch('backup.send_discord_notification')
+    def test_daemon_job_errors_reported(self, mock_notify):
+        from backup import _BackupPool, _report_daemon_job
+        import functools
+        print(f"{YELLOW}Action: Running a daemon backup that raises outside run_backup...{RESET}")
+        server = {"host": "a"}
+        with patch('backup._run_backup_job', side_effect=KeyError("print")), _BackupPool(1) as pool:
+            future = pool.submit(self.config, server, "app", 60)
+            future.add_done_callback(functools.partial(_report_daemon_job, self.config, server, "app"))
+        mock_notify.assert_called_once()
+        self.assertIn("Backup of app on a failed: 'print'", mock_notify.call_args.args[1])
+        print(f"{GREEN}Result: The error is printed and sent through on_failure.{RESET}")
+
+    def test_interrupt_cancels_queued_backups(self):
+        from backup import _BackupPool, _cancel_on_exit
+        import threading
+        print(f"{YELLOW}Action: Interrupting 'now' while backups are queued...{RESET}")
+        ran = []
+        started = threading.Event()
+        cancelled = threading.Event()
+        def fake_job(config, server, db_name, db_timeout, notifications=None):
+            ran.append(db_name)
+            started.set()
+            # Still running when the interrupt cancels the queued backups
+            cancelled.wait(timeout=10)
+        with patch('backup._run_backup_job', side_effect=fake_job):
+            with self.assertRaises(KeyboardInterrupt):
+                with _BackupPool(4) as pool, _cancel_on_exit(pool):
+                    futures = [pool.submit({}, {"host": "a"}, f"db{i}", 60) for i in range(8)]
+                    futures[1].add_done_callback(lambda f: cancelled.set())
+                    self.assertTrue(started.wait(timeout=10))
+                    raise KeyboardInterrupt
+        self.assertEqual(ran, ["db0"])
+        self.assertTrue(all(f.cancelled() for f in futures[1:]))
+        print(f"{GREEN}Result: Only the running backup finished.{RESET}")
+
+    def test_reload_requests_coalesce(self):
+        import backup
+        print(f"{YELLOW}Action: Requesting several reloads before the daemon wakes...{RESET}")
+        pipe = os.pipe()
+        for fd in pipe:
+            os.set_blocking(fd, False)
+            self.addCleanup(os.close, fd)
+        with patch('backup._RELOAD_PIPE', pipe):
+            backup._request_reload(None, None)
+            backup._request_reload(None, None)
+            self.assertTrue(backup._wait_for_reload(0))
+            self.assertFalse(backup._wait_for_reload(0))
+        print(f"{GREEN}Result: One reload for both requests.{RESET}")
+
+    @patch.dict('backup.TOOLS', {"zstd": "/usr/bin/zstd"})
+    def test_compressor_selection(self):
+        from backup import get_compress_command, get_backup_extension
+        print(f"{YELLOW}Action: Checking compressor command and extension selection...{RESET}")
+        self.assertEqual(get_backup_extension(self.config), ".sql.gz")
+        self.assertEqual(get_compress_command(self.config)[-1], "-6")
+        print(f"{GREEN}Result: gzip is the default at level 6.{RESET}")
+
+        config = {"storage": {"compressor": "zstd"}}
+        self.assertEqual(get_backup_extension(config), ".sql.zst")
+        self.assertEqual(get_compress_command(config), ["/usr/bin/zstd", "-q", "-T0", "-3"])
+        print(f"{GREEN}Result: zstd writes .sql.zst at level 3.{RESET}")
+
+        config = {"storage": {"compressor": "zstd", "compress_threads": 2}}
+        self.assertEqual(get_compress_command(config), ["/usr/bin/zstd", "-q", "-T2", "-3"])
+        print(f"{GREEN}Result: compress_threads limits compressor threads.{RESET}")
+
+        config = {"storage": {"compressor": "zstd", "rsyncable": True}}
+        self.assertEqual(get_compress_command(config), ["/usr/bin/zstd", "-q", "-T0", "-3", "--rsyncable"])
+        print(f"{GREEN}Result: rsyncable adds --rsyncable.{RESET}")
+
+        config = {"storage": {"compress_command": "gzip --rsyncable"}}
+        self.assertEqual(get_compress_command(config), ["gzip", "--rsyncable"])
+        print(f"{GREEN}Result: Custom compress_command is used as-is.{RESET}")
+
+    @patch('backup._pooled_query', return_value=["app", "mysql", "old_app"])
+    @patch('backup._server_pool', return_value=object())
+    def test_get_databases_pooled(self, mock_pool, mock_query):
+        from backup import get_databases, _DATABASES_CACHE
+        print(f"{YELLOW}Action: Listing databases through the connector pool twice...{RESET}")
+        server = {"host": "pooled-host", "user": "u", "password": "p", "exclude": ["old_app"]}
+        _DATABASES_CACHE.pop("pooled-host", None)
+        self.assertEqual(get_databases(server), ["app"])
+        self.assertEqual(get_databases(server), ["app"])
+        mock_query.assert_called_once()
+        print(f"{GREEN}Result: System and excluded databases filtered, second lookup cached.{RESET}")
+
+    def test_get_databases_pool_unreachable(self):
+        from backup import get_databases, _DATABASES_CACHE
+        print(f"{YELLOW}Action: Listing databases when the pool can't connect...{RESET}")
+        fake_mariadb = MagicMock(Error=type("Error", (Exception,), {}))
+        server = {"host": "down-host", "user": "u", "password": "p"}
+        _DATABASES_CACHE.pop("down-host", None)
+        with patch('backup.mariadb', fake_mariadb), \
+                patch('backup._server_pool', side_effect=fake_mariadb.Error("Can't connect")):
+            self.assertEqual(get_databases(server), [])
+        self.assertNotIn("down-host", _DATABASES_CACHE)
+        print(f"{GREEN}Result: Empty list returned, failure not cached.{RESET}")
+
+    def test_upload_command(self):
+        from backup import get_upload_command
+        print(f"{YELLOW}Action: Formatting upload_command...{RESET}")
+        self.assertIsNone(get_upload_command(self.config, "h1", "app", "app-01-01-2024-1.sql.gz"))
+        config = {"storage": {"upload_command": "rclone rcat 'remote:my backups/{host}/{filename}'"}}
+        self.assertEqual(
+            get_upload_command(config, "h1", "app", "app-01-01-2024-1.sql.gz"),
+            ["rclone", "rcat", "remote:my backups/h1/app-01-01-2024-1.sql.gz"],
+        )
+        print(f"{GREEN}Result: Placeholders filled in after splitting.{RESET}")
+
+    @patch('backup.send_discord_notification')
+    def test_upload_timeout_keeps_backup(self, mock_notify):
+        from backup import run_backup
+        import backup
+        print(f"{YELLOW}Action: Backing up with an upload that outlives the timeout...{RESET}")
+        fake_dump = self.test_dir / "fake-dump"
+        fake_dump.write_text("#!/bin/sh\necho 'SELECT 1;'\n")
+        fake_dump.chmod(0o755)
+        config = dict(self.config, storage=dict(self.config["storage"], upload_command="sh -c 'sleep 4'"))
+        tools = {"mariadb-dump": str(fake_dump.resolve()), "pigz": None, "gzip": shutil.which("gzip")}
+        with patch.dict(backup.TOOLS, tools), patch('backup.apply_retention'):
+            run_backup(config, "localhost", "root", "pw", "app", timeout=1)
+
+        backups = list((self.test_dir / "localhost").glob("app-*.sql.gz"))
+        self.assertEqual(len(backups), 1)
+        with gzip.open(backups[0]) as f:
+            self.assertEqual(f.read(), b"SELECT 1;\n")
+        messages = [c.args[1] for c in mock_notify.call_args_list]
+        self.assertTrue(messages[0].endswith("completed successfully."))
+        self.assertIn("Upload of app on localhost failed: timed out", messages[1])
+        print(f"{GREEN}Result: Local backup kept, upload reported as failed.{RESET}")
+
+    @patch('backup.send_discord_notification')
+    def test_stale_listing_never_overwrites(self, mock_notify):
+        from backup import run_backup
+        import backup
+        import datetime
+        print(f"{YELLOW}Action: Backing up while the cached listing misses today's backup...{RESET}")
+        fake_dump = self.test_dir / "fake-dump"
+        fake_dump.write_text("#!/bin/sh\necho 'SELECT 1;'\n")
+        fake_dump.chmod(0o755)
+        host_dir = self.test_dir / "localhost"
+        host_dir.mkdir()
+        existing = host_dir / f"app-{datetime.datetime.now().strftime('%d-%m-%Y')}-1.sql.gz"
+        existing.write_bytes(b"earlier backup")
+        tools = {"mariadb-dump": str(fake_dump.resolve()), "pigz": None, "gzip": shutil.which("gzip")}
+        with patch.dict(backup.TOOLS, tools), patch('backup._host_index', return_value=[]), \
+                patch('backup.apply_retention'):
+            run_backup(self.config, "localhost", "root", "pw", "app")
+        self.assertEqual(existing.read_bytes(), b"earlier backup")
+        self.assertTrue(existing.with_name(existing.name.replace("-1.sql.gz", "-2.sql.gz")).exists())
+        print(f"{GREEN}Result: The existing backup is kept, the new one is number 2.{RESET}")
+
+    @patch('backup.send_discord_notification')
+    def test_stalled_upload_keeps_large_backup(self, mock_notify):
+        from backup import run_backup
+        import backup
+        print(f"{YELLOW}Action: Backing up 8MB while the upload never reads...{RESET}")
+        fake_dump = self.test_dir / "fake-dump"
+        fake_dump.write_text("#!/bin/sh\nhead -c 8388608 /dev/urandom\n")
+        fake_dump.chmod(0o755)
+        config = dict(self.config, storage=dict(self.config["storage"], upload_command="sleep 6"))
+        tools = {"mariadb-dump": str(fake_dump.resolve()), "pigz": None, "gzip": shutil.which("gzip")}
+        with patch.dict(backup.TOOLS, tools), patch('backup.apply_retention'):
+            run_backup(config, "localhost", "root", "pw", "app", timeout=2)
+            messages = [c.args[1] for c in mock_notify.call_args_list]
+            self.assertTrue(messages[0].endswith("completed successfully."))
+            self.assertIn("Upload of app on localhost failed: timed out", messages[1])
+            print(f"{GREEN}Result: Local backup kept, upload timed out.{RESET}")
+
+            mock_notify.reset_mock()
+            with patch('backup.UPLOAD_BUFFER_SIZE', 2 * 1024 * 1024):
+                run_backup(config, "localhost", "root", "pw", "app", timeout=2)
+            messages = [c.args[1] for c in mock_notify.call_args_list]
+            self.assertTrue(messages[0].endswith("completed successfully."))
+            self.assertIn("fell more than 2MB behind", messages[1])
+            print(f"{GREEN}Result: An upload that falls behind is given up on.{RESET}")
+
+        backups = list((self.test_dir / "localhost").glob("app-*.sql.gz"))
+        self.assertEqual(len(backups), 2)
+        for path in backups:
+            with gzip.open(path) as f:
+                self.assertEqual(len(f.read()), 8388608)
+
+    @patch('backup.send_discord_notification')
+    def test_failed_dump_skips_upload_wait(self, mock_notify):
+        from backup import run_backup
+        import backup
+        print(f"{YELLOW}Action: Backing up with a dump that fails and an upload that hangs...{RESET}")
+        fake_dump = self.test_dir / "fake-dump"
+        fake_dump.write_text("#!/bin/sh\necho 'Access denied' >&2\nexit 2\n")
+        fake_dump.chmod(0o755)
+        config = dict(self.config, storage=dict(self.config["storage"], upload_command="sleep 30"))
+        tools = {"mariadb-dump": str(fake_dump.resolve()), "pigz": None, "gzip": shutil.which("gzip")}
+        begin = time.monotonic()
+        with patch.dict(backup.TOOLS, tools):
+            run_backup(config, "localhost", "root", "pw", "app", timeout=30)
+        self.assertLess(time.monotonic() - begin, 20)
+        self.assertIn("failed: Access denied", mock_notify.call_args.args[1])
+        print(f"{GREEN}Result: The dump failure is reported without waiting for the upload.{RESET}")
+
+    @patch('backup.send_discord_notification')
+    def test_retention_sees_new_backup_size(self, mock_notify):
+        from backup import run_backup
+        import backup
+        print(f"{YELLOW}Action: Backing up while another backup lists the host directory...{RESET}")
+        fake_dump = self.test_dir / "fake-dump"
+        fake_dump.write_text("#!/bin/sh\necho 'SELECT 1;'\n")
+        fake_dump.chmod(0o755)
+        host_dir = self.test_dir / "localhost"
+        host_dir.mkdir()
+        old = host_dir / "app-01-01-2024-1.sql.gz"
+        old.write_bytes(b"x" * 2000)
+        # The old backup fits on its own, but not together with the new one
+        config = dict(self.config, retention={"default": {"keep_last": 10, "max_gb": 2010 / 1024**3}})
+        def list_mid_dump(pipe):
+            # A sibling backup caches the listing while the new file is still empty
+            past = time.time() - 10
+            os.utime(host_dir, (past, past))
+            backup._host_index(host_dir)
+        tools = {"mariadb-dump": str(fake_dump.resolve()), "pigz": None, "gzip": shutil.which("gzip")}
+        with patch.dict(backup.TOOLS, tools), patch('backup._enlarge_pipe', side_effect=list_mid_dump):
+            run_backup(config, "localhost", "root", "pw", "app")
+
+        self.assertFalse(old.exists())
+        self.assertEqual(len(list(host_dir.glob("app-*.sql.gz"))), 1)
+        print(f"{GREEN}Result: The old backup was pruned by size.{RESET}")
+
+    @patch('backup.send_discord_notification')
+    def test_unstartable_upload_stops_dump(self, mock_notify):
+        from backup import run_backup
+        import backup
+        import subprocess
+        print(f"{YELLOW}Action: Backing up with an upload program that isn't installed...{RESET}")
+        fake_dump = self.test_dir / "fake-dump"
+        fake_dump.write_text("#!/bin/sh\nexec yes 'SELECT 1;'\n")
+        fake_dump.chmod(0o755)
+        config = dict(self.config, storage=dict(self.config["storage"], upload_command="upload-not-installed - {filename}"))
+        tools = {"mariadb-dump": str(fake_dump.resolve()), "pigz": None, "gzip": shutil.which("gzip")}
+        started = []
+        real_popen = subprocess.Popen
+        def popen(*args, **kwargs):
+            p = real_popen(*args, **kwargs)
+            started.append(p)
+            return p
+        with patch.dict(backup.TOOLS, tools), patch('subprocess.Popen', side_effect=popen):
+            run_backup(config, "localhost", "root", "pw", "app", timeout=5)
+
+        self.assertEqual(len(started), 2) # Dump and compressor
+        self.assertTrue(all(p.poll() is not None for p in started))
+        self.assertEqual(list((self.test_dir / "localhost").glob("app-*.sql.gz")), [])
+        self.assertIn("Backup of app on localhost failed", mock_notify.call_args.args[1])
+        print(f"{GREEN}Result: Backup failed, dump and compressor stopped.{RESET}")
+
+    def test_tee_stops_on_local_write_error(self):
+        from backup import _Tee
+        import subprocess
+        print(f"{YELLOW}Action: Teeing an endless stream into a full disk...{RESET}")
+        source = subprocess.Popen(["yes"], stdout=subprocess.PIPE)
+        upload = subprocess.Popen(["cat"], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+        dst = MagicMock()
+        dst.write.side_effect = OSError(28, "No space left on device")
+        tee = _Tee(source.stdout, dst, upload)
+        tee.start()
+        tee.join(timeout=5)
+        self.assertFalse(tee.is_alive())
+        self.assertEqual(tee.error.errno, 28)
+        # Both ends are released instead of hanging until the backup times out
+        self.assertNotEqual(source.wait(timeout=5), 0)
+        self.assertEqual(upload.wait(timeout=5), 0)
+        print(f"{GREEN}Result: Error kept, compressor and upload stopped.{RESET}")
+
+    def test_client_env_numeric_password(self):
+        from backup import _client_env
+        print(f"{YELLOW}Action: Building the docker exec environment for password: 123456...{RESET}")
+        self.assertEqual(_client_env(123456, "mariadb")["MYSQL_PWD"], "123456")
+        self.assertIsNone(_client_env(123456))
+        print(f"{GREEN}Result: MYSQL_PWD is passed as a string.{RESET}")
+
+    def test_remove_stale_credentials(self):
+        from backup import _remove_stale_credentials
+        import subprocess
+        print(f"{YELLOW}Action: Removing option files of runs that are gone...{RESET}")
+        exited = subprocess.Popen(["true"])
+        exited.wait()
+        stale = self.test_dir / f"mariadb-backup-{exited.pid}-abc"
+        live = self.test_dir / f"mariadb-backup-{os.getpid()}-def"
+        for d in (stale, live):
+            d.mkdir()
+            (d / "x.cnf").write_text("[client]\n")
+        _remove_stale_credentials(self.test_dir)
+        self.assertFalse(stale.exists())
+        self.assertTrue(live.exists())
+        print(f"{GREEN}Result: Only the dead run's directory was removed.{RESET}")
+
+    @patch.dict('backup.TOOLS', {"mariadb-dump": "/usr/bin/mariadb-dump", "docker": None, "pigz": None, "gzip": "/bin/gzip"})
+    def test_find_missing_tools(self):
+        from backup import find_missing_tools
+        print(f"{YELLOW}Action: Checking tools for a local and a container server...{RESET}")
+        config = {"servers": [{"host": "a", "databases": ["db"]}]}
+        self.assertEqual(find_missing_tools(config), [])
+        config["servers"].append({"host": "b", "container": "mariadb", "databases": ["db"]})
+        missing = find_missing_tools(config)
+        self.assertEqual(len(missing), 1)
+        self.assertTrue(missing[0].startswith("docker not found."))
+        print(f"{GREEN}Result: Only the missing docker is reported.{RESET}")
+
+        config = {"servers": [{"host": "a", "databases": ["db"]}], "storage": {"upload_command": "upload-not-installed - {filename}"}}
+        missing = find_missing_tools(config)
+        self.assertEqual(len(missing), 1)
+        self.assertTrue(missing[0].startswith("upload-not-installed not found."))
+        print(f"{GREEN}Result: A missing upload program is reported.{RESET}")
+
+        config = {"servers": [{"host": "a", "databases": ["db"]}], "storage": {"upload_command": "awk '{print}'"}}
+        missing = find_missing_tools(config)
+        self.assertEqual(len(missing), 1)
+        self.assertTrue(missing[0].startswith("Invalid placeholder in storage.upload_command"))
+        print(f"{GREEN}Result: A literal brace in upload_command is reported.{RESET}")
+
+        config = {"servers": [{"host": "a", "databases": ["db"]}], "storage": {"compress_command": "pgz -p 4"}}
+        missing = find_missing_tools(config)
+        self.assertEqual(len(missing), 1)
+        self.assertTrue(missing[0].startswith("pgz not found."))
+        print(f"{GREEN}Result: A mistyped compress_command is reported.{RESET}")
+
+    @patch('backup._SESSION.post')
     def test_discord_notification(self, mock_post):
         from backup import send_discord_notification
         print(f"{YELLOW}Action: Testing Discord notification...{RESET}")
         config = {"discord": {"webhook_url": "http://fake-webhook"}}
-        send_discord_notification(config, "Test Message")
+        send_discord_notification(config, "Test Message").result(timeout=5)
         mock_post.assert_called_once()
         print(f"{GREEN}Result: Discord notification call verified.{RESET}")
 
+    def test_discord_timeouts(self):
+        from backup import _post_discord
+        import contextlib
+        import io
+        import requests
+        print(f"{YELLOW}Action: Posting to a webhook that times out connecting, then reading...{RESET}")
+        for error, expected in ((requests.ConnectTimeout(), "could not connect within 3s"),
+                                (requests.ReadTimeout(), "no response within 5s")):
+            out = io.StringIO()
+            with patch('backup._SESSION.post', side_effect=error), contextlib.redirect_stdout(out):
+                _post_discord("http://fake-webhook", "Test Message")
+            self.assertIn(expected, out.getvalue())
+        print(f"{GREEN}Result: Connect and read timeouts are reported separately.{RESET}")
+
+    @patch('backup.send_discord_notification')
+    def test_notification_buffer(self, mock_send):
+        from backup import NotificationBuffer, DISCORD_MAX_LENGTH
+        print(f"{YELLOW}Action: Flushing a batch of notifications...{RESET}")
+        buffer = NotificationBuffer()
+        buffer.add("Backup of a on h1 completed successfully.")
+        buffer.add("Backup of b on h1 completed successfully.")
+        buffer.add("x" * (DISCORD_MAX_LENGTH + 10))
+        buffer.flush(self.config)
+
+        chunks = [c.args[1] for c in mock_send.call_args_list]
+        self.assertEqual(len(chunks), 3)
+        self.assertTrue(chunks[0].startswith("Backup of a") and "Backup of b" in chunks[0])
+        self.assertTrue(all(len(c) <= DISCORD_MAX_LENGTH for c in chunks))
+        print(f"{GREEN}Result: Messages coalesced and kept under the length limit.{RESET}")
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)